@@ -0,0 +1,185 @@
+import base64
+import hashlib
+from datetime import date
+from flask import Blueprint, Response, jsonify, request, session, url_for
+from sqlalchemy import select
+
+from helpers import decode_item
+from models import db, DeletedEntry, Entry, Item
+from views import item_names
+
+# JSON API for the mobile and sync clients, under /api/v1. It uses the same login (session cookie) as the
+# website. Every page is found with keyset pagination, so page 1000 costs the same as page 1:
+#   GET /api/v1/entries?order=desc&after=2024-05-01&limit=50
+#       The user's entries by day (newest first by default) after a day, through the (user_id, log_date) index.
+#       The response has a "next" URL while there are more.
+#   GET /api/v1/entries?since=<sync token>
+#       The entries saved and the days deleted after the sync token (everything without one), in the order
+#       of their change numbers (see sync.py), through the (user_id, change_number) indexes. "deleted" has
+#       the days of a page that were deleted, apply them before its entries (a day that was deleted and
+#       logged again is in both). Clients keep the "sync_token" of the last page for their next sync.
+#   GET /api/v1/entries/2024-05-01
+#       A single day.
+# The items of a page are loaded with one more query and sent decoded, under the item's name. Pages have
+# an ETag made from the ids and revisions of their entries, checked before the items are loaded.
+
+API_VERSION = 1
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+# Registered by create_app() in app.py
+api = Blueprint("api", __name__, url_prefix="/api/v1")
+
+
+class BadRequest(Exception):
+    pass
+
+
+def _limit():
+    limit = request.args.get("limit", DEFAULT_LIMIT, type=int)
+    return min(max(limit, 1), MAX_LIMIT)
+
+
+def _day(value, name):
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise BadRequest(f"{name} must be a date (YYYY-MM-DD)")
+
+
+def sync_token(change_number):
+    return base64.urlsafe_b64encode(f"change|{change_number}".encode()).decode().rstrip("=")
+
+
+def _parse_sync_token(token):
+    # Tokens from before change numbers (a time and an id) aren't accepted, those clients sync from the start
+    try:
+        kind, change_number = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode().split("|")
+        if kind != "change":
+            raise ValueError(kind)
+        return int(change_number)
+    except ValueError:
+        raise BadRequest("since isn't a sync token from this API")
+
+
+def _etag(user_id, entries, deleted=()):
+    digest = hashlib.sha1(f"{API_VERSION}:{user_id}:{request.full_path}".encode())
+    for entry in entries:
+        digest.update(f"|{entry.id}.{entry.revision}".encode())
+    for day in deleted:
+        digest.update(f"|-{day.log_date}.{day.change_number}".encode())
+    return digest.hexdigest()
+
+
+def _entry_columns():
+    return select(Entry.id, Entry.log_date, Entry.date_logged, Entry.revision, Entry.updated_at, Entry.change_number)
+
+
+def _payloads(entries, item_names):
+    # The items of every entry on the page in one query, only the ones with content
+    contents = {}
+    if entries:
+        items = db.session.execute(
+            select(Item.entry_id, Item.category, Item.encoding, Item.content)
+            .where(Item.entry_id.in_([entry.id for entry in entries]), Item.content.isnot(None))
+        )
+        for item in items:
+            if item.category in item_names:
+                contents.setdefault(item.entry_id, {})[item_names[item.category]] = decode_item(item.encoding, item.content)
+    return [
+        {
+            "date": entry.log_date.isoformat(),
+            "logged_at": entry.date_logged.isoformat(timespec="seconds") if entry.date_logged else None,
+            "updated_at": entry.updated_at.isoformat() if entry.updated_at else None,
+            "revision": entry.revision,
+            "items": contents.get(entry.id, {}),
+        }
+        for entry in entries
+    ]
+
+
+def _respond(user_id, entries, item_names, single=False, deleted=None, **fields):
+    etag = _etag(user_id, entries, deleted or ())
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    elif single:
+        response = jsonify(_payloads(entries, item_names)[0])
+    else:
+        if deleted is not None:
+            fields["deleted"] = [day.log_date.isoformat() for day in deleted]
+        response = jsonify(entries=_payloads(entries, item_names), **fields)
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def list_entries(user_id, item_names):
+    limit = _limit()
+    since = request.args.get("since")
+    if since is not None:
+        after = _parse_sync_token(since) if since else 0
+        entries = db.session.execute(
+            _entry_columns()
+            .where(Entry.user_id == user_id, Entry.log_date.isnot(None), Entry.change_number > after)
+            .order_by(Entry.change_number)
+            .limit(limit + 1)
+        ).all()
+        deleted = db.session.execute(
+            select(DeletedEntry.log_date, DeletedEntry.change_number)
+            .where(DeletedEntry.user_id == user_id, DeletedEntry.change_number > after)
+            .order_by(DeletedEntry.change_number)
+            .limit(limit + 1)
+        ).all()
+        # The first limit changes of both, a page ends where either list's next change would come
+        changes = sorted([(entry.change_number, entry) for entry in entries] + [(day.change_number, day) for day in deleted],
+                         key=lambda change: change[0])
+        more = len(changes) > limit
+        changes = changes[:limit]
+        last = changes[-1][0] if changes else after
+        entries = [entry for entry in entries if entry.change_number <= last]
+        deleted = [day for day in deleted if day.change_number <= last]
+        token = sync_token(last)
+        next_url = url_for("api.entries", since=token, limit=limit) if more else None
+        return _respond(user_id, entries, item_names, deleted=deleted, sync_token=token, next=next_url)
+
+    order = request.args.get("order", "desc")
+    if order not in ("asc", "desc"):
+        raise BadRequest("order must be asc or desc")
+    query = _entry_columns().where(Entry.user_id == user_id, Entry.log_date.isnot(None))
+    after = request.args.get("after")
+    if after:
+        day = _day(after, "after")
+        query = query.where(Entry.log_date > day if order == "asc" else Entry.log_date < day)
+    query = query.order_by(Entry.log_date if order == "asc" else Entry.log_date.desc())
+    entries = db.session.execute(query.limit(limit + 1)).all()
+    more = len(entries) > limit
+    entries = entries[:limit]
+    next_url = url_for("api.entries", order=order, after=entries[-1].log_date.isoformat(), limit=limit) if more else None
+    return _respond(user_id, entries, item_names, next=next_url)
+
+
+@api.route("/entries")
+def entries():
+    if session.get("user_id") is None:
+        return jsonify(error="log in first"), 401
+    try:
+        return list_entries(session["user_id"], item_names())
+    except BadRequest as error:
+        return jsonify(error=str(error)), 400
+
+
+@api.route("/entries/<day>")
+def entry(day):
+    if session.get("user_id") is None:
+        return jsonify(error="log in first"), 401
+    try:
+        log_date = _day(day, "the day")
+    except BadRequest as error:
+        return jsonify(error=str(error)), 400
+    found = db.session.execute(
+        _entry_columns().where(Entry.user_id == session["user_id"], Entry.log_date == log_date)
+    ).first()
+    if found is None:
+        return jsonify(error=f"nothing logged on {log_date.isoformat()}"), 404
+    return _respond(session["user_id"], [found], item_names(), single=True)
@@ -0,0 +1,66 @@
+import json
+import random
+from datetime import date, timedelta
+from flask import current_app
+
+from history import import_entries
+from models import db, User, Prefs
+from views import item_names
+
+# Synthetic diaries for benchmarking. Every user gets a diary going back `years` from yesterday (today is
+# left for the /log scenario to create), with a day skipped now and then, a Summary of random length and a
+# Happiness value every day, and a Location on some days for the users that have it in their preferences.
+# Everything is seeded so two runs with the same arguments build the same database.
+
+PASSWORD = "benchmark1"
+WORDS = ("sunny beach walk work meeting lunch friends family dinner coffee rain train book movie gym run "
+         "tired happy calm busy quiet long short early late park city trip home garden music call cook "
+         "read write study code bike swim market school office night morning afternoon weekend holiday").split()
+PLACES = ("Paris, France", "Boston, USA", "Lisbon, Portugal", "Kyoto, Japan", "Oslo, Norway", "Home")
+
+
+def email(number):
+    return f"bench{number}@example.com"
+
+
+def diary_lines(rng, years, with_location, end=None):
+    """Yield a user's synthetic diary as the JSON Lines that history.import_entries reads."""
+    end = end or date.today() - timedelta(days=1)
+    day = end - timedelta(days=365 * years)
+    while day <= end:
+        # About one day in ten isn't logged
+        if rng.random() >= 0.1:
+            row = {
+                "date": day.isoformat(),
+                "summary": " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 120))),
+                "happiness": rng.randint(1, 100),
+            }
+            if with_location and rng.random() < 0.3:
+                row["location"] = rng.choice(PLACES)
+            yield json.dumps(row)
+        day += timedelta(days=1)
+
+
+def generate(users=10, years=2, seed=1):
+    """Fill the database of the current app with users bench0@example.com ... and their diaries.
+
+    Needs an app context of an app from create_app(), whose database should be empty.
+    :returns: The number of entries created.
+    """
+    rng = random.Random(seed)
+    # Every user has the same password, hashing it once keeps generating fast
+    password_hash = current_app.extensions["password_hasher"].hash(PASSWORD)
+    names = item_names()
+    entries = 0
+    for number in range(users):
+        user = User(firstname="Bench", lastname=str(number), email=email(number), hash=password_hash)
+        db.session.add(user)
+        db.session.commit()
+        # Every third user also logs their location
+        with_location = number % 3 == 0
+        for category in (1, 2, 3) if with_location else (1, 2):
+            db.session.add(Prefs(category, user.id))
+        db.session.commit()
+        report = import_entries(user.id, diary_lines(rng, years, with_location), names)
+        entries += report["imported"]
+    return entries
@@ -0,0 +1,210 @@
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+from datetime import date, timedelta
+
+import click
+
+# Load benchmark for DiaryLite. Virtual users (threads with their own Flask test client, so the app runs
+# in-process without a server) log in and then repeat the flow index -> log -> save the day -> prefs ->
+# results of a random day. Every request's latency and number of SQL queries is recorded per route, and the
+# summary is written as JSON so that two runs (say before and after a change) can be compared:
+#
+#   python -m bench.run --output before.json
+#   ... change something ...
+#   python -m bench.run --output after.json --baseline before.json
+#
+# The synthetic database is built by bench/generate.py the first time (or with --regenerate) and reused
+# afterwards so that runs are comparable.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SPANS = ("1", "3", "week", "month")
+
+
+def percentile(sorted_values, percent):
+    # Nearest rank, good enough for the few thousand samples of a run
+    if not sorted_values:
+        return 0
+    rank = max(0, min(len(sorted_values) - 1, round(percent / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+class Recorder:
+    """Collects the latency and number of queries of every request per route, counting queries with a SQLAlchemy cursor event."""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.samples = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        event.listen(engine, "before_cursor_execute", self._count)
+
+    def _count(self, connection, cursor, statement, parameters, context, executemany):
+        # The test client runs the request on the calling thread, so the thread's counter is the request's
+        self._local.queries = getattr(self._local, "queries", 0) + 1
+
+    def request(self, client, route, method, path, **kwargs):
+        self._local.queries = 0
+        started = time.perf_counter()
+        response = client.open(path, method=method, **kwargs)
+        elapsed = (time.perf_counter() - started) * 1000
+        if response.status_code >= 400:
+            raise RuntimeError(f"{method} {path} returned {response.status_code}")
+        with self._lock:
+            self.samples.setdefault(route, []).append((elapsed, self._local.queries))
+        return response
+
+    def summary(self, seconds):
+        routes = {}
+        total = 0
+        for route, samples in sorted(self.samples.items()):
+            latencies = sorted(sample[0] for sample in samples)
+            total += len(samples)
+            routes[route] = {
+                "requests": len(samples),
+                "p50_ms": round(percentile(latencies, 50), 3),
+                "p95_ms": round(percentile(latencies, 95), 3),
+                "p99_ms": round(percentile(latencies, 99), 3),
+                "mean_ms": round(sum(latencies) / len(latencies), 3),
+                "queries_per_request": round(sum(sample[1] for sample in samples) / len(samples), 2),
+            }
+        return {
+            "routes": routes,
+            "total": {"requests": total, "seconds": round(seconds, 3), "requests_per_second": round(total / seconds, 1)},
+        }
+
+
+def virtual_user(app, recorder, number, users, flows, seed, errors):
+    from bench.generate import PASSWORD, email
+    rng = random.Random(seed * 1000 + number)
+    client = app.test_client()
+    # Each virtual user comes from its own address so the login throttle of one IP isn't hit
+    client.environ_base["REMOTE_ADDR"] = f"10.0.{number // 250}.{number % 250 + 1}"
+    try:
+        recorder.request(client, "POST /login", "POST", "/login", data={"email": email(number % users), "password": PASSWORD})
+        for flow in range(flows):
+            recorder.request(client, "GET /", "GET", "/")
+            recorder.request(client, "GET /log", "GET", "/log")
+            recorder.request(client, "POST /log", "POST", "/log", data={
+                "summarybox": f"benchmark flow {flow} of user {number}",
+                "happinessbox": str(rng.randint(1, 100)),
+            })
+            recorder.request(client, "GET /prefs", "GET", "/prefs")
+            if flow % 5 == 4:
+                recorder.request(client, "POST /prefs", "POST", "/prefs", data={"summary": "on", "happiness": "on"})
+            # Any day of the last year of the generated history
+            day = date.today() - timedelta(days=rng.randint(1, 365))
+            recorder.request(client, "GET /results", "GET", "/results", query_string={
+                "searchbar": day.strftime("%m-%d-%Y"), "span": rng.choice(SPANS),
+            })
+    except Exception as error:
+        errors.append(f"virtual user {number}: {error}")
+
+
+def compare(summary, baseline, threshold):
+    """Print the change of every route against a baseline run, returning the routes whose p95 got worse than threshold %."""
+    regressions = []
+    click.echo(f"{'route':<14} {'p50 ms':>18} {'p95 ms':>18} {'p99 ms':>18} {'queries':>12}")
+    for route, stats in summary["routes"].items():
+        before = baseline["routes"].get(route)
+        if before is None:
+            click.echo(f"{route:<14} (not in baseline)")
+            continue
+        columns = []
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            change = (stats[key] - before[key]) / before[key] * 100 if before[key] else 0
+            columns.append(f"{stats[key]:>9.2f} ({change:+5.0f}%)")
+        columns.append(f"{before['queries_per_request']:>5} -> {stats['queries_per_request']:<4}")
+        click.echo(f"{route:<14} " + " ".join(columns))
+        if before["p95_ms"] and (stats["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100 > threshold:
+            regressions.append(route)
+    before, after = baseline["total"]["requests_per_second"], summary["total"]["requests_per_second"]
+    click.echo(f"throughput {before} -> {after} requests/s")
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+@click.command()
+@click.option("--database", default=os.path.join(ROOT, "bench", "bench.db"), show_default=True, help="SQLite file of the synthetic diaries.")
+@click.option("--regenerate", is_flag=True, help="Build the synthetic database again even if it exists.")
+@click.option("--users", default=10, show_default=True, help="Users in the synthetic database.")
+@click.option("--years", default=2, show_default=True, help="Years of daily entries per user.")
+@click.option("--seed", default=1, show_default=True, help="Seed of the generator and the virtual users.")
+@click.option("--concurrency", default=4, show_default=True, help="Virtual users running at the same time.")
+@click.option("--flows", default=25, show_default=True, help="Times each virtual user goes through the flow.")
+@click.option("--output", type=click.Path(dir_okay=False), help="Write the results as JSON to this file.")
+@click.option("--baseline", type=click.File("r"), help="JSON of an earlier run to compare with.")
+@click.option("--threshold", default=20.0, show_default=True, help="Exit with an error when a route's p95 is this many percent slower than the baseline.")
+def main(database, regenerate, users, years, seed, concurrency, flows, output, baseline, threshold):
+    """Run the DiaryLite load benchmark."""
+    database = os.path.abspath(database)
+    if regenerate:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(database + suffix):
+                os.remove(database + suffix)
+    generated = not os.path.exists(database)
+    os.environ.setdefault("DIARYLITE_ENV", "production")
+    sys.path.insert(0, ROOT)
+    from app import create_app
+    from bench.generate import generate
+    from models import db
+
+    app = create_app({"SQLALCHEMY_DATABASE_URI": f"sqlite:///{database}"})
+
+    with app.app_context():
+        if generated:
+            started = time.perf_counter()
+            entries = generate(users, years, seed)
+            click.echo(f"generated {users} users and {entries} entries in {time.perf_counter() - started:.1f}s", err=True)
+        recorder = Recorder(db.engine)
+    # Templates are compiled by the first request that renders them, that isn't part of the measurements
+    app.test_client().get("/login")
+
+    errors = []
+    threads = [threading.Thread(target=virtual_user, args=(app, recorder, number, users, flows, seed, errors))
+               for number in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    summary = recorder.summary(time.perf_counter() - started)
+    summary["run"] = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "users": users,
+        "years": years,
+        "seed": seed,
+        "concurrency": concurrency,
+        "flows": flows,
+        "errors": errors,
+    }
+    for error in errors:
+        click.echo(error, err=True)
+
+    if output:
+        with open(output, "w") as output_file:
+            json.dump(summary, output_file, indent=2)
+    if baseline:
+        regressions = compare(summary, json.load(baseline), threshold)
+        if regressions:
+            raise click.ClickException(f"p95 more than {threshold}% slower than the baseline for {', '.join(regressions)}")
+    else:
+        click.echo(json.dumps(summary, indent=2))
+    if errors:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
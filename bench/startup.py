@@ -0,0 +1,82 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+import click
+
+# How long a new worker takes to be ready: importing app.py, create_app() and the first request (which
+# compiles the templates it renders). Every run is a fresh Python process, like a worker that was just
+# started, against a database that is already up to date:
+#
+#   python -m bench.startup --output startup.json
+#   python -m bench.startup --baseline startup.json
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child process, prints the timings as JSON
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+application = app.create_app({"SQLALCHEMY_DATABASE_URI": sys.argv[1]})
+created = time.perf_counter()
+client = application.test_client()
+status = client.get("/login").status_code
+answered = time.perf_counter()
+print(json.dumps({"import_ms": (imported - started) * 1000, "create_app_ms": (created - imported) * 1000,
+                  "first_request_ms": (answered - created) * 1000, "status": status}))
+"""
+STAGES = ("import_ms", "create_app_ms", "first_request_ms", "total_ms")
+
+
+def probe(uri):
+    result = subprocess.run([sys.executable, "-c", PROBE, uri], cwd=ROOT, capture_output=True, text=True,
+                            env=dict(os.environ, DIARYLITE_ENV=os.environ.get("DIARYLITE_ENV", "production")))
+    if result.returncode != 0:
+        raise click.ClickException(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "probe failed")
+    timings = json.loads(result.stdout)
+    if timings.pop("status") != 200:
+        raise click.ClickException("the first request didn't return 200")
+    timings["total_ms"] = timings["import_ms"] + timings["create_app_ms"] + timings["first_request_ms"]
+    return timings
+
+
+@click.command()
+@click.option("--runs", default=10, show_default=True, help="Fresh processes to time.")
+@click.option("--database", type=click.Path(dir_okay=False), help="SQLite file to start against, a new one by default.")
+@click.option("--output", type=click.Path(dir_okay=False), help="Write the results as JSON to this file.")
+@click.option("--baseline", type=click.File("r"), help="JSON of an earlier run to compare with.")
+def main(runs, database, output, baseline):
+    """Time the startup of a DiaryLite worker."""
+    with tempfile.TemporaryDirectory() as directory:
+        uri = f"sqlite:///{os.path.abspath(database or os.path.join(directory, 'startup.db'))}"
+        # The first start creates or upgrades the database, that's a one-time step and isn't counted
+        probe(uri)
+        samples = [probe(uri) for _ in range(runs)]
+    summary = {
+        stage: {
+            "median": round(statistics.median(sample[stage] for sample in samples), 2),
+            "min": round(min(sample[stage] for sample in samples), 2),
+            "max": round(max(sample[stage] for sample in samples), 2),
+        }
+        for stage in STAGES
+    }
+    summary["runs"] = runs
+    if output:
+        with open(output, "w") as output_file:
+            json.dump(summary, output_file, indent=2)
+    if baseline:
+        before = json.load(baseline)
+        for stage in STAGES:
+            change = (summary[stage]["median"] - before[stage]["median"]) / before[stage]["median"] * 100
+            click.echo(f"{stage:<18} {before[stage]['median']:>9.1f} -> {summary[stage]['median']:>9.1f} ms ({change:+.0f}%)")
+    else:
+        click.echo(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
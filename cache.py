@@ -0,0 +1,58 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """A bounded, thread-safe mapping that forgets its least recently used keys and keys older than ttl.
+
+    The cache lives in one process, so anything stored in it has to be safe to serve slightly stale
+    from other workers (or carry a version to check, like the preferences cache in views.py).
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            found = self._data.get(key)
+            if found is None:
+                return default
+            value, expires = found
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            found = self._data.pop(key, None)
+        return default if found is None else found[0]
+
+    def expire(self):
+        """Drop every key that is past its ttl."""
+        if self.ttl is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            for key in [key for key, (value, expires) in self._data.items() if expires < now]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,79 @@
+import hashlib
+import os
+from functools import lru_cache
+from flask import current_app, request, url_for
+
+from cache import LRUCache
+
+# HTTP caching. Past days in /results are served with a strong ETag so revisits are answered with a 304
+# before anything is rendered, and the rendered modal of each entry is kept per (user, day) so a changed
+# window only renders the entries that changed. Static files get a fingerprint in their URL so browsers
+# can keep them for a year.
+
+# Bump when memory_results.html changes, so pages rendered with the old template stop matching
+RESULTS_VERSION = 1
+STATIC_MAX_AGE = 365 * 24 * 60 * 60
+
+# Rendered modals kept per app (in app.extensions["fragments"], built by init_app)
+FRAGMENTS_SIZE = 10000
+FRAGMENTS_TTL = 24 * 60 * 60
+
+
+def results_etag(user_id, start, end, versions, static_version=""):
+    """Build the ETag of a /results window from the (entry id, revision, item id) rows of its entries.
+
+    static_version is the app's static_version(), so a page linking to assets that changed isn't answered with a 304.
+    """
+    digest = hashlib.sha1(f"{RESULTS_VERSION}:{user_id}:{start}:{end}:{static_version}".encode())
+    for row in versions:
+        digest.update(f"|{row.id}.{row.revision}.{row.item_id}".encode())
+    return digest.hexdigest()
+
+
+def get_fragment(user_id, day, entry_id, revision):
+    cached = current_app.extensions["fragments"].get((user_id, day))
+    if cached is not None and cached[0] == entry_id and cached[1] == revision:
+        return cached[2]
+    return None
+
+
+def set_fragment(user_id, day, entry_id, revision, html):
+    current_app.extensions["fragments"].set((user_id, day), (entry_id, revision, html))
+
+
+def forget_day(user_id, day):
+    """Drop the cached modal of a day, called when the day is saved."""
+    current_app.extensions["fragments"].pop((user_id, day))
+
+
+def init_app(app):
+    # (user_id, log_date) -> (entry id, revision, rendered modal)
+    app.extensions["fragments"] = LRUCache(maxsize=FRAGMENTS_SIZE, ttl=FRAGMENTS_TTL)
+
+    @lru_cache(maxsize=256)
+    def fingerprint(path, mtime):
+        # The modification time is part of the key, so a file edited while the app runs gets a new fingerprint
+        with open(path, "rb") as static_file:
+            return hashlib.md5(static_file.read()).hexdigest()[:12]
+
+    def static_url(filename):
+        # The fingerprint only changes when the file does, so the URL can be cached forever
+        path = os.path.join(app.static_folder, filename)
+        return url_for("static", filename=filename, v=fingerprint(path, os.stat(path).st_mtime_ns))
+
+    def static_version():
+        # The fingerprints of every static file, a stat() each, changes whenever any of their URLs would
+        return ",".join(
+            fingerprint(static_file.path, static_file.stat().st_mtime_ns)
+            for static_file in sorted(os.scandir(app.static_folder), key=lambda static_file: static_file.name)
+            if static_file.is_file()
+        )
+
+    app.jinja_env.globals["static_url"] = static_url
+    app.extensions["static_version"] = static_version
+
+    @app.after_request
+    def cache_static(response):
+        if request.endpoint == "static" and request.args.get("v") and response.status_code == 200:
+            response.headers["Cache-Control"] = f"public, max-age={STATIC_MAX_AGE}, immutable"
+        return response
@@ -0,0 +1,78 @@
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+import database
+import migrations
+from history import delete_history, import_entries, DELETE_CHUNK_SIZE, IMPORT_CHUNK_SIZE
+from models import User
+from views import item_names
+
+# `flask ...` commands, added to the app by create_app() in app.py
+
+
+@click.command("upgrade-db")
+@with_appcontext
+def upgrade_db_command():
+    """Create missing tables and migrate the database to the newest schema."""
+    migrated = migrations.upgrade()
+    if migrated:
+        click.echo(f"migrated database to version {len(migrations.MIGRATIONS)} ({', '.join(migrated)})")
+    else:
+        click.echo(f"database is up to date (version {len(migrations.MIGRATIONS)})")
+
+
+@click.command("db-settings")
+@with_appcontext
+def db_settings_command():
+    """Show the pragmas and pool the database is opened with."""
+    for name, value in database.settings().items():
+        click.echo(f"{name} = {value}")
+    click.echo(f"pool_size = {current_app.config['SQLITE_POOL_SIZE']}, serialized writes = {current_app.config['SQLITE_SERIALIZE_WRITES']}")
+
+
+@click.command("convert-items")
+@with_appcontext
+@click.option("--batch-size", default=1000, show_default=True, help="Items converted per transaction.")
+def convert_items_command(batch_size):
+    """Convert base64 items to raw or compressed content."""
+    converted = migrations.convert_items(batch_size)
+    click.echo(f"converted {converted} items, run VACUUM on the database to give the freed space back")
+
+
+@click.command("delete-history")
+@with_appcontext
+@click.argument("email")
+@click.option("--chunk-size", default=DELETE_CHUNK_SIZE, show_default=True, help="Entries deleted per transaction, 0 for all at once.")
+def delete_history_command(email, chunk_size):
+    """Delete every entry and item of the user with EMAIL."""
+    user = User.query.filter_by(email=email).first()
+    if user is None:
+        raise click.ClickException(f"No account registered with {email}")
+    deleted_entries, deleted_items = delete_history(user.id, chunk_size or None)
+    click.echo(f"deleted {deleted_entries} entries and {deleted_items} items")
+
+
+@click.command("import-diary")
+@with_appcontext
+@click.argument("email")
+@click.argument("file", type=click.File("rb"))
+@click.option("--chunk-size", default=IMPORT_CHUNK_SIZE, show_default=True, help="Entries inserted per transaction.")
+def import_diary_command(email, file, chunk_size):
+    """Import the JSON Lines entries in FILE into the diary of the user with EMAIL."""
+    user = User.query.filter_by(email=email).first()
+    if user is None:
+        raise click.ClickException(f"No account registered with {email}")
+    report = import_entries(user.id, file, item_names(), chunk_size)
+    for error in report["errors"]:
+        click.echo(error, err=True)
+    click.echo(f"imported {report['imported']} entries in {report['seconds']}s ({report['per_second']}/s), "
+               f"skipped {report['duplicates']} duplicate days and {report['invalid']} invalid lines")
+
+
+COMMANDS = (upgrade_db_command, db_settings_command, convert_items_command, delete_history_command, import_diary_command)
+
+
+def init_app(app):
+    for command in COMMANDS:
+        app.cli.add_command(command)
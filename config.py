@@ -0,0 +1,53 @@
+import os
+
+# Configuration profiles for create_app() in app.py, picked with DIARYLITE_ENV (development by default).
+# Settings that other modules own (the SQLITE_* ones of database.py, SLOW_REQUEST_MS of instrumentation.py)
+# have their defaults there, any of them can be set here or passed to create_app() to override them.
+
+
+class Config:
+    SECRET_KEY = os.environ.get("DIARYLITE_SECRET_KEY", "No one will ever find out")
+    # DIARYLITE_DATABASE_URI points the app at another database, like the synthetic one of bench/
+    SQLALCHEMY_DATABASE_URI = os.environ.get("DIARYLITE_DATABASE_URI", "sqlite:///diarylite.db")
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Templates are checked for changes on disk on every render
+    TEMPLATES_AUTO_RELOAD = True
+    # Create missing tables and run pending migrations when the app is created. Once the database is up to
+    # date this is a single PRAGMA, turn it off when `flask upgrade-db` is part of deploying
+    UPGRADE_DB_ON_START = True
+    # Server side sessions (instead of signed cookies). "sqlite" is shared by every worker on the host and
+    # survives restarts, "memory" is fastest but only works with a single worker, and "filesystem" is
+    # Flask-Session's store in a temporary directory
+    SESSION_BACKEND = os.environ.get("DIARYLITE_SESSION_BACKEND", "sqlite")
+    SESSION_PERMANENT = False
+    # Password hashing runs in a pool of processes (one per core unless DIARYLITE_HASH_WORKERS is set).
+    # Raising DIARYLITE_HASH_ITERATIONS upgrades every user's hash the next time they log in
+    PASSWORD_HASH_ITERATIONS = int(os.environ.get("DIARYLITE_HASH_ITERATIONS", 260000))
+    PASSWORD_HASH_WORKERS = int(os.environ.get("DIARYLITE_HASH_WORKERS", 0)) or None
+    # Number of proxies (like nginx) in front of the app. When set, the client's address and scheme are
+    # taken from their X-Forwarded-For/X-Forwarded-Proto headers, so the login throttle counts attempts per
+    # client and not per proxy. Leave it at 0 when the app is reached directly, the headers could be forged
+    TRUSTED_PROXIES = int(os.environ.get("DIARYLITE_TRUSTED_PROXIES", 0))
+
+
+class DevelopmentConfig(Config):
+    pass
+
+
+class ProductionConfig(Config):
+    TEMPLATES_AUTO_RELOAD = False
+
+
+class TestingConfig(Config):
+    TESTING = True
+    # A database of its own in memory, and hashes that are quick to make
+    SQLALCHEMY_DATABASE_URI = "sqlite://"
+    SESSION_BACKEND = "memory"
+    PASSWORD_HASH_ITERATIONS = 1000
+
+
+PROFILES = {
+    "development": DevelopmentConfig,
+    "production": ProductionConfig,
+    "testing": TestingConfig,
+}
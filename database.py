@@ -0,0 +1,87 @@
+import os
+import threading
+from contextlib import contextmanager
+from flask import current_app
+from sqlalchemy import event, text
+from sqlalchemy.pool import QueuePool
+
+from models import db
+
+# How the SQLite database is opened. Every connection gets the pragmas below as it's made:
+#   journal_mode=WAL: readers see the last commit and never wait on a writer (and a writer never waits on readers)
+#   synchronous=NORMAL: commits don't fsync, the WAL is synced at checkpoints. A power cut can lose the last
+#     commits but never corrupts the database
+#   mmap_size/cache_size: reads come from memory mapped pages and a 16MB page cache per connection
+#   busy_timeout: a writer that finds the database locked by another worker waits up to 5s instead of
+#     failing straight away with "database is locked"
+# Connections are kept in a pool per worker instead of opening the file (and reading the schema) on every
+# request, sized for the threads of one worker.
+
+PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -16000,
+    "busy_timeout": 5000,
+    "temp_store": "MEMORY",
+}
+
+# Databases that only exist in the memory of their one connection (for tests)
+MEMORY_URIS = ("sqlite://", "sqlite:///:memory:")
+
+# Only one thread of a worker writes at a time when SQLITE_SERIALIZE_WRITES is on
+_write_lock = threading.Lock()
+
+
+def _set_pragmas(pragmas):
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            # PRAGMA doesn't accept bound parameters
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
+    return set_pragmas
+
+
+def init_app(app):
+    """Configure the engine of db for app, call after db.init_app(app).
+
+    Set SQLITE_POOL_SIZE to the number of threads of a worker, SQLITE_PRAGMAS to change the pragmas above and
+    SQLITE_SERIALIZE_WRITES to make the writes of a worker's threads take turns instead of racing for the
+    database's lock.
+    """
+    app.config.setdefault("SQLITE_POOL_SIZE", int(os.environ.get("DIARYLITE_DB_POOL_SIZE", 8)))
+    app.config.setdefault("SQLITE_PRAGMAS", dict(PRAGMAS))
+    app.config.setdefault("SQLITE_SERIALIZE_WRITES", os.environ.get("DIARYLITE_DB_SERIALIZE_WRITES", "0") == "1")
+
+    # An in memory database (for tests) is a single connection that Flask-SQLAlchemy sets up itself
+    if app.config["SQLALCHEMY_DATABASE_URI"] not in MEMORY_URIS:
+        options = app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {})
+        options.setdefault("poolclass", QueuePool)
+        options.setdefault("pool_size", app.config["SQLITE_POOL_SIZE"])
+        options.setdefault("max_overflow", app.config["SQLITE_POOL_SIZE"])
+        # Pooled connections are handed from thread to thread, but only ever used by one thread at a time
+        options.setdefault("connect_args", {}).setdefault("check_same_thread", False)
+
+    with app.app_context():
+        event.listen(db.engine, "connect", _set_pragmas(app.config["SQLITE_PRAGMAS"]))
+
+
+@contextmanager
+def writer():
+    """Wrap the flush and commit of a write, so the writes of one worker are serialized if configured.
+
+    Reads never go through here. Holding the lock while doing slow work (like hashing) holds up every other
+    writer of the worker, so only the part that talks to the database belongs inside.
+    """
+    if not current_app.config["SQLITE_SERIALIZE_WRITES"]:
+        yield
+        return
+    with _write_lock:
+        yield
+
+
+def settings():
+    """Get the pragmas a connection of the current app's engine actually runs with. Needs an app context."""
+    with db.engine.connect() as connection:
+        return {name: connection.execute(text(f"PRAGMA {name}")).scalar() for name in PRAGMAS}
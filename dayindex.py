@@ -0,0 +1,90 @@
+import calendar
+from sqlalchemy import delete, select, text
+from sqlalchemy.orm import joinedload
+
+from models import db, DayIndex, Entry
+
+# The days each user has logged, as a bitmap per year in day_index. A month grid or a whole year is one
+# row, and "on this day" in every past year is one query for the user's rows (a handful of small blobs)
+# plus one for the entries it found, instead of probing the entry table day by day.
+# Days only ever get logged through /log and imports, and are only removed by deleting the whole history,
+# so the index is kept up to date by mark() on saves, rebuild() after imports and remove_user().
+
+YEAR_BYTES = 46  # 366 bits
+
+
+def _bit(day):
+    return day.timetuple().tm_yday - 1
+
+
+def _has(days, day):
+    bit = _bit(day)
+    return bool(days[bit // 8] & (1 << bit % 8))
+
+
+def mark(user_id, day):
+    """Add a logged day to the user's index. Runs in the current db.session transaction."""
+    row = DayIndex.query.get((user_id, day.year))
+    if row is None:
+        row = DayIndex(user_id=user_id, year=day.year, days=bytes(YEAR_BYTES))
+        db.session.add(row)
+    bit = _bit(day)
+    days = bytearray(row.days)
+    days[bit // 8] |= 1 << bit % 8
+    row.days = bytes(days)
+
+
+def remove_user(user_id):
+    db.session.execute(delete(DayIndex).where(DayIndex.user_id == user_id).execution_options(synchronize_session=False))
+
+
+def rebuild(connection, user_id=None):
+    """Build day_index from the entries' log_date, for one user or everyone.
+
+    Used by migrations.py and after bulk imports.
+    """
+    user_filter = "" if user_id is None else "WHERE user_id = :user_id"
+    connection.execute(text(f"DELETE FROM day_index {user_filter}"), {"user_id": user_id})
+    query = select(Entry.user_id, Entry.log_date).where(Entry.log_date.isnot(None))
+    if user_id is not None:
+        query = query.where(Entry.user_id == user_id)
+    years = {}
+    for row in connection.execute(query):
+        days = years.setdefault((row.user_id, row.log_date.year), bytearray(YEAR_BYTES))
+        bit = _bit(row.log_date)
+        days[bit // 8] |= 1 << bit % 8
+    if years:
+        connection.execute(text("INSERT INTO day_index (user_id, year, days) VALUES (:user_id, :year, :days)"), [
+            {"user_id": user, "year": year, "days": bytes(days)} for (user, year), days in years.items()
+        ])
+
+
+def month(user_id, year, month):
+    """Get the weeks (Monday first) of a month as lists of (date, logged) pairs, None for days of other months."""
+    row = DayIndex.query.get((user_id, year))
+    weeks = []
+    for week in calendar.Calendar().monthdatescalendar(year, month):
+        weeks.append([
+            (day, row is not None and _has(row.days, day)) if day.month == month else None
+            for day in week
+        ])
+    return weeks
+
+
+def on_this_day(user_id, day):
+    """Get the user's entries (items loaded) from the same day of every earlier year, the latest first."""
+    rows = DayIndex.query.filter(DayIndex.user_id == user_id, DayIndex.year < day.year).all()
+    days = []
+    for row in rows:
+        # February 29th only comes back in leap years
+        if day.month == 2 and day.day == 29 and not calendar.isleap(row.year):
+            continue
+        past = day.replace(year=row.year)
+        if _has(row.days, past):
+            days.append(past)
+    if not days:
+        return []
+    return (Entry.query.options(joinedload(Entry.items))
+            .filter(Entry.user_id == user_id, Entry.log_date.in_(days))
+            .order_by(Entry.log_date.desc())
+            .all())
@@ -1,5 +1,8 @@
 import base64
+import calendar
 import re
+import zlib
+from datetime import date, timedelta
 from functools import wraps
 from flask import redirect, session
 
@@ -17,6 +20,39 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+# Formats of Item.content, stored in Item.encoding
+BASE64 = 0  # What every item was stored as before, base64 of the UTF-8 text
+RAW = 1  # The UTF-8 text
+ZLIB = 2  # The UTF-8 text compressed with zlib, for long items
+# Items longer than this many bytes are compressed if that makes them smaller
+COMPRESS_THRESHOLD = 256
+
+
+def encode(text):
+    """Encode a string the way Item.content is stored.
+
+    :param text: The text typed into an item's input
+    :returns: An (encoding, content) tuple for Item.encoding and Item.content.
+
+    """
+    data = text.encode('utf-8')
+    if len(data) > COMPRESS_THRESHOLD:
+        compressed = zlib.compress(data)
+        if len(compressed) < len(data):
+            return ZLIB, compressed
+    return RAW, data
+
+
+def decode_item(encoding, content):
+    """Get the text of an item back from its encoding and content."""
+    if content is None:
+        return ""
+    if encoding == RAW:
+        return str(content, 'utf-8')
+    if encoding == ZLIB:
+        return str(zlib.decompress(content), 'utf-8')
+    return decode(content)
+
 # Sourced from https://stackoverflow.com/questions/2941995/python-ignore-incorrect-padding-error-when-base64-decoding/9807138#9807138
 def decode(data, altchars=b'+/'):
     """Decode base64, padding being optional.
@@ -30,3 +66,30 @@ def decode(data, altchars=b'+/'):
     if missing_padding:
         data += b'='* (4 - missing_padding)
     return str(base64.b64decode(data, altchars), "utf-8")
+
+
+# Largest number of days on each side of a searched day that /results will load
+MAX_WINDOW_DAYS = 31
+
+
+def date_window(day, span):
+    """Get the first and last day (inclusive) of the window around a day.
+
+    :param day: The date the window is built around
+    :param span: "week" or "month" for the calendar week/month containing day, otherwise a number of days
+        on each side of day. Anything that isn't a number falls back to 1 day.
+    :returns: A (start, end) tuple of dates.
+
+    """
+    if span == "week":
+        start = day - timedelta(days=day.weekday())
+        return start, start + timedelta(days=6)
+    if span == "month":
+        last_day = calendar.monthrange(day.year, day.month)[1]
+        return day.replace(day=1), day.replace(day=last_day)
+    try:
+        days = min(max(int(span), 0), MAX_WINDOW_DAYS)
+    except (TypeError, ValueError):
+        days = 1
+    # Cut short at the first and last days a date can have
+    return day - timedelta(days=min(days, (day - date.min).days)), day + timedelta(days=min(days, (date.max - day).days))
@@ -0,0 +1,278 @@
+import csv
+import io
+import json
+import time
+import zlib
+from datetime import date, datetime
+from sqlalchemy import delete, insert, select
+
+from helpers import decode_item, encode
+
+import database
+import dayindex
+import mood
+import search
+import sync
+from models import db, Entry, Item
+
+# Operations on a user's whole diary history
+
+# Entries deleted per transaction when a history is deleted from the website
+DELETE_CHUNK_SIZE = 500
+# Entries read per query when a history is exported
+EXPORT_PAGE_SIZE = 500
+# Entries inserted per transaction when a history is imported. Kept under SQLite's old limit of 999
+# variables per statement since the chunk's days are used in an IN (...)
+IMPORT_CHUNK_SIZE = 500
+# Most validation messages kept in an import report
+MAX_IMPORT_ERRORS = 20
+
+
+def delete_history(user_id, chunk_size=None):
+    """Delete every entry of a user along with its items and search rows, leaving tombstones for sync clients.
+
+    Items are removed with a single DELETE ... WHERE entry_id IN (subquery) instead of one query per entry.
+
+    :param user_id: The user whose history is deleted
+    :param chunk_size: When None everything is deleted in one transaction. Otherwise at most chunk_size
+        entries are deleted per transaction, so the SQLite write lock is released between chunks. Every
+        chunk is complete on its own, so if this is interrupted calling it again carries on where it stopped.
+    :returns: A (deleted entries, deleted items) tuple.
+
+    """
+    deleted_entries = 0
+    deleted_items = 0
+    while True:
+        entry_ids = select(Entry.id).where(Entry.user_id == user_id).order_by(Entry.id)
+        if chunk_size:
+            entry_ids = entry_ids.limit(chunk_size)
+        with database.writer():
+            # The first delete takes SQLite's write lock, so the subquery picks the same entries for all three
+            item_ids = select(Item.id).where(Item.entry_id.in_(entry_ids))
+            search.remove_items(item_ids)
+            # Sync clients of the API are told which days went
+            sync.record_deletions(user_id, db.session.execute(
+                select(Entry.log_date).where(Entry.id.in_(entry_ids), Entry.log_date.isnot(None))
+            ).scalars().all())
+            deleted_items += db.session.execute(
+                delete(Item).where(Item.entry_id.in_(entry_ids)).execution_options(synchronize_session=False)
+            ).rowcount
+            entries = db.session.execute(
+                delete(Entry).where(Entry.id.in_(entry_ids)).execution_options(synchronize_session=False)
+            ).rowcount
+            if not chunk_size or entries == 0:
+                # Everything derived from the history goes with the last chunk
+                mood.remove_user(user_id)
+                dayindex.remove_user(user_id)
+            db.session.commit()
+        deleted_entries += entries
+        if not chunk_size or entries == 0:
+            return deleted_entries, deleted_items
+
+
+def _export_pages(user_id, page_size):
+    # Days in date order through the (user_id, log_date) index (a day is unique per user, so the date alone
+    # is the keyset), then the few old entries that have no log_date (see migrations.py) by id
+    last_day = None
+    while True:
+        query = select(Entry.id, Entry.log_date, Entry.date_logged).where(Entry.user_id == user_id, Entry.log_date.isnot(None))
+        if last_day is not None:
+            query = query.where(Entry.log_date > last_day)
+        entries = db.session.execute(query.order_by(Entry.log_date).limit(page_size)).all()
+        if not entries:
+            break
+        yield entries
+        last_day = entries[-1].log_date
+    last_id = 0
+    while True:
+        entries = db.session.execute(
+            select(Entry.id, Entry.log_date, Entry.date_logged)
+            .where(Entry.user_id == user_id, Entry.log_date.is_(None), Entry.id > last_id)
+            .order_by(Entry.id)
+            .limit(page_size)
+        ).all()
+        if not entries:
+            return
+        yield entries
+        last_id = entries[-1].id
+
+
+def export_rows(user_id, item_names, page_size=EXPORT_PAGE_SIZE):
+    """Generate every entry of a user, oldest day first, as a dict of its date and decoded items.
+
+    Entries are read page_size at a time with keyset pagination on the day, and the items of each page
+    with one more query, so memory use doesn't grow with the length of the history.
+
+    :param item_names: Dict of category to the key its content is stored under (e.x. {1: "summary"})
+    """
+    for entries in _export_pages(user_id, page_size):
+        contents = {}
+        items = db.session.execute(
+            select(Item.entry_id, Item.category, Item.encoding, Item.content)
+            .where(Item.entry_id.in_([entry.id for entry in entries]), Item.content.isnot(None))
+        )
+        for item in items:
+            if item.category in item_names:
+                contents.setdefault(item.entry_id, {})[item_names[item.category]] = decode_item(item.encoding, item.content)
+        for entry in entries:
+            row = {
+                "date": entry.log_date.isoformat() if entry.log_date else None,
+                "logged_at": entry.date_logged.isoformat(timespec="seconds") if entry.date_logged else None,
+            }
+            row.update(contents.get(entry.id, {}))
+            yield row
+
+
+def jsonl_chunks(rows, rows_per_chunk=100):
+    """Turn rows into JSON Lines, joined into one string every rows_per_chunk rows."""
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(row, ensure_ascii=False) + "\n")
+        if len(lines) == rows_per_chunk:
+            yield "".join(lines)
+            lines = []
+    if lines:
+        yield "".join(lines)
+
+
+def csv_chunks(rows, fields, rows_per_chunk=100):
+    """Turn rows into CSV with a header of fields, in strings of rows_per_chunk rows."""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction="ignore")
+    writer.writeheader()
+    written = 0
+    for row in rows:
+        writer.writerow(row)
+        written += 1
+        if written % rows_per_chunk == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def gzip_chunks(chunks):
+    """Gzip a stream of strings as it goes."""
+    # wbits=31 writes a gzip header and trailer instead of a raw zlib stream
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk.encode("utf-8"))
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def _parse_import_line(line, categories):
+    # Returns (day, logged_at, {category: text}) for a line of JSON, raises ValueError when it's not valid
+    row = json.loads(line)
+    if not isinstance(row, dict):
+        raise ValueError("each line must be a JSON object")
+    try:
+        day = date.fromisoformat(row.get("date") or "")
+    except (TypeError, ValueError):
+        raise ValueError("date must be YYYY-MM-DD")
+    if day > date.today():
+        raise ValueError("date is in the future")
+    logged_at = datetime.combine(day, datetime.min.time())
+    if row.get("logged_at"):
+        try:
+            logged_at = datetime.fromisoformat(row["logged_at"])
+        except (TypeError, ValueError):
+            raise ValueError("logged_at must be an ISO date and time")
+    contents = {}
+    for name, category in categories.items():
+        value = row.get(name)
+        if value is None or value == "":
+            continue
+        if not isinstance(value, (str, int)):
+            raise ValueError(f"{name} must be text")
+        contents[category] = str(value)
+    if not contents:
+        raise ValueError(f"no items, expected at least one of {', '.join(categories)}")
+    if mood.CATEGORY in contents:
+        score = mood.parse_score(contents[mood.CATEGORY])
+        if score is None:
+            raise ValueError(f"happiness must be a number from {mood.MIN_SCORE} to {mood.MAX_SCORE}")
+        contents[mood.CATEGORY] = str(score)
+    return day, logged_at, contents
+
+
+def _import_chunk(user_id, chunk, report):
+    # Days the user already has are left alone, importing never overwrites what was logged on the website
+    existing = set(db.session.execute(
+        select(Entry.log_date).where(Entry.user_id == user_id, Entry.log_date.in_(list(chunk)))
+    ).scalars())
+    new = {day: parsed for day, parsed in chunk.items() if day not in existing}
+    report["duplicates"] += len(chunk) - len(new)
+    if not new:
+        return
+    first_change = sync.next_changes(user_id, len(new))
+    db.session.execute(insert(Entry), [
+        {"user_id": user_id, "date_logged": logged_at, "log_date": day, "change_number": first_change + number}
+        for number, (day, (logged_at, contents)) in enumerate(new.items())
+    ])
+    # executemany can't return the new ids, they are looked up with the same index the dedupe used
+    entry_ids = dict(db.session.execute(
+        select(Entry.log_date, Entry.id).where(Entry.user_id == user_id, Entry.log_date.in_(list(new)))
+    ).all())
+    items = []
+    for day, (logged_at, contents) in new.items():
+        for category, text in contents.items():
+            encoding, content = encode(text)
+            items.append({"category": category, "encoding": encoding, "content": content, "entry_id": entry_ids[day]})
+    db.session.execute(insert(Item), items)
+    search.index_entries(list(entry_ids.values()))
+    report["imported"] += len(new)
+
+
+def import_entries(user_id, lines, item_names, chunk_size=IMPORT_CHUNK_SIZE):
+    """Import dated entries from JSON Lines (the format export_rows writes) into a user's diary.
+
+    Lines are validated and encoded chunk_size at a time, and each chunk is inserted with two executemany
+    statements in its own transaction. Days the user already has an entry for are skipped, as are repeats
+    of a day within the file.
+
+    :param lines: Iterable of str or bytes lines, e.x. an open file
+    :param item_names: Dict of category to the key its content is read from (e.x. {1: "summary"})
+    :returns: A report dict with the number of imported entries, duplicates, invalid lines, the first
+        validation errors, the seconds it took and entries imported per second.
+
+    """
+    started = time.perf_counter()
+    categories = {name: category for category, name in item_names.items()}
+    report = {"imported": 0, "duplicates": 0, "invalid": 0, "errors": []}
+    seen = set()
+    chunk = {}
+    for number, line in enumerate(lines, start=1):
+        try:
+            if isinstance(line, bytes):
+                line = line.decode("utf-8")
+            if not line.strip():
+                continue
+            day, logged_at, contents = _parse_import_line(line, categories)
+        except ValueError as error:
+            report["invalid"] += 1
+            if len(report["errors"]) < MAX_IMPORT_ERRORS:
+                report["errors"].append(f"line {number}: {error}")
+            continue
+        if day in seen:
+            report["duplicates"] += 1
+            continue
+        seen.add(day)
+        chunk[day] = (logged_at, contents)
+        if len(chunk) == chunk_size:
+            with database.writer():
+                _import_chunk(user_id, chunk, report)
+                db.session.commit()
+            chunk = {}
+    with database.writer():
+        if chunk:
+            _import_chunk(user_id, chunk, report)
+        if report["imported"]:
+            # Imported days land anywhere in the history, so the rollups, streak and day index are built again in one go
+            mood.rebuild(db.session.connection(), user_id)
+            dayindex.rebuild(db.session.connection(), user_id)
+        db.session.commit()
+    report["seconds"] = round(time.perf_counter() - started, 3)
+    report["per_second"] = round(report["imported"] / report["seconds"]) if report["seconds"] else 0
+    return report
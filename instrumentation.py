@@ -0,0 +1,215 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from flask import Blueprint, Response, g, has_request_context, request
+from jinja2 import Template
+from sqlalchemy import event
+
+from models import db
+
+# Where the time of a request goes. SQLAlchemy's cursor events count and time every query of a request, the
+# connection's commit event counts its commits, the app's templates are timed as they render, and the
+# request hooks put it together when the response goes out:
+#   * histograms per route of latency, queries, SQL time, commits and template time, served in Prometheus'
+#     text format on /metrics (the numbers are per worker, Prometheus adds the workers up)
+#   * a warning in the app's log for every request slower than SLOW_REQUEST_MS, with its slowest statements
+# All of it is a few perf_counter() calls and additions per query and request, cheap enough to leave on.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+COMMIT_BUCKETS = (0, 1, 2, 3, 5, 10)
+# Statements kept per request for the slow request log
+MAX_STATEMENTS = 100
+SLOWEST_STATEMENTS = 5
+
+
+class Histogram:
+    """A Prometheus histogram with route and method labels."""
+
+    def __init__(self, name, description, buckets):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        # (route, method) -> [count per bucket (the last one is +Inf), sum, count]
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                counts = self.values[labels] = [[0] * (len(self.buckets) + 1), 0, 0]
+            counts[0][index] += 1
+            counts[1] += value
+            counts[2] += 1
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            values = [(labels, list(counts[0]), counts[1], counts[2]) for labels, counts in sorted(self.values.items())]
+        for (route, method), buckets, total, count in values:
+            labels = f'route="{route}",method="{method}"'
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + ("+Inf",), buckets):
+                cumulative += bucket
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {count}")
+        return lines
+
+
+class Counter:
+    """A Prometheus counter with route, method and status labels."""
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels):
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + 1
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self.values.items())
+        for (route, method, status), value in values:
+            lines.append(f'{self.name}{{route="{route}",method="{method}",status="{status}"}} {value}')
+        return lines
+
+
+request_seconds = Histogram("diarylite_request_seconds", "Time to handle a request.", LATENCY_BUCKETS)
+request_queries = Histogram("diarylite_request_queries", "SQL statements executed per request.", QUERY_BUCKETS)
+request_sql_seconds = Histogram("diarylite_request_sql_seconds", "Time spent executing SQL per request.", LATENCY_BUCKETS)
+request_commits = Histogram("diarylite_request_commits", "Database commits per request.", COMMIT_BUCKETS)
+request_template_seconds = Histogram("diarylite_request_template_seconds", "Time spent rendering templates per request.", LATENCY_BUCKETS)
+responses = Counter("diarylite_responses_total", "Responses sent.")
+slow_requests = Counter("diarylite_slow_requests_total", "Requests slower than SLOW_REQUEST_MS.")
+METRICS = (request_seconds, request_queries, request_sql_seconds, request_commits, request_template_seconds, responses, slow_requests)
+
+# /metrics, registered by init_app()
+metrics_endpoint = Blueprint("instrumentation", __name__)
+
+
+class RequestMetrics:
+    __slots__ = ("started", "queries", "sql_seconds", "commits", "template_seconds", "statements")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.commits = 0
+        self.template_seconds = 0.0
+        self.statements = []
+
+
+def current():
+    """Get the RequestMetrics of the request being handled, or None outside of a request."""
+    if not has_request_context():
+        return None
+    return g.get("request_metrics")
+
+
+class TimedTemplate(Template):
+    # Flask renders every template through render(), templates they extend or include are part of the same call
+    def render(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            metrics = current()
+            if metrics is not None:
+                metrics.template_seconds += time.perf_counter() - started
+
+
+def _before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    connection.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - connection.info["query_started"].pop()
+    metrics = current()
+    if metrics is not None:
+        metrics.queries += 1
+        metrics.sql_seconds += elapsed
+        if len(metrics.statements) < MAX_STATEMENTS:
+            metrics.statements.append((elapsed, statement))
+
+
+def _handle_error(context):
+    # after_cursor_execute isn't called for a statement that failed
+    started = context.connection.info.get("query_started") if context.connection is not None else None
+    if started:
+        started.pop()
+
+
+def _commit(connection):
+    metrics = current()
+    if metrics is not None:
+        metrics.commits += 1
+
+
+def _log_slow_request(app, metrics, latency):
+    slowest = sorted(metrics.statements, key=lambda statement: statement[0], reverse=True)[:SLOWEST_STATEMENTS]
+    statements = "".join(f"\n  {elapsed * 1000:.1f}ms {' '.join(statement.split())}" for elapsed, statement in slowest)
+    app.logger.warning(
+        f"slow request {request.method} {request.full_path.rstrip('?')} took {latency * 1000:.0f}ms: "
+        f"{metrics.queries} queries in {metrics.sql_seconds * 1000:.1f}ms, {metrics.commits} commits, "
+        f"templates {metrics.template_seconds * 1000:.1f}ms{statements}"
+    )
+
+
+def expose():
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.expose())
+    return "\n".join(lines) + "\n"
+
+
+@metrics_endpoint.route("/metrics")
+def metrics():
+    return Response(expose(), mimetype="text/plain; version=0.0.4")
+
+
+def init_app(app):
+    """Instrument app and the engine of db, and add the /metrics endpoint. Call after db.init_app(app).
+
+    Call before the app renders (and so compiles) any template, templates compiled earlier aren't timed.
+    """
+    app.config.setdefault("SLOW_REQUEST_MS", int(os.environ.get("DIARYLITE_SLOW_REQUEST_MS", 500)))
+    app.jinja_env.template_class = TimedTemplate
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(db.engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(db.engine, "handle_error", _handle_error)
+        event.listen(db.engine, "commit", _commit)
+
+    @app.before_request
+    def start_request_metrics():
+        g.request_metrics = RequestMetrics()
+
+    @app.after_request
+    def record_request_metrics(response):
+        metrics = g.pop("request_metrics", None)
+        if metrics is None or request.endpoint == "instrumentation.metrics":
+            return response
+        latency = time.perf_counter() - metrics.started
+        # The route's pattern (like /static/<path:filename>) rather than the path keeps the number of labels small
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        labels = (route, request.method)
+        request_seconds.observe(labels, latency)
+        request_queries.observe(labels, metrics.queries)
+        request_sql_seconds.observe(labels, metrics.sql_seconds)
+        request_commits.observe(labels, metrics.commits)
+        request_template_seconds.observe(labels, metrics.template_seconds)
+        responses.inc(labels + (response.status_code,))
+        if latency * 1000 >= app.config["SLOW_REQUEST_MS"]:
+            slow_requests.inc(labels + (response.status_code,))
+            _log_slow_request(app, metrics, latency)
+        return response
+
+    app.register_blueprint(metrics_endpoint)
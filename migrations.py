@@ -0,0 +1,170 @@
+from flask import current_app
+from sqlalchemy import bindparam, select, text, update
+
+import dayindex
+import mood
+import search
+from helpers import decode, encode, BASE64
+from models import db, Item
+
+# Schema changes for databases that were created before a column/table existed. db.create_all() only
+# creates missing tables, it never alters existing ones, so every change to an existing table goes here.
+# The version of the database is kept in SQLite's PRAGMA user_version, and every migration is written so
+# that running it on a database that create_all() just built is harmless.
+
+
+def _columns(connection, table):
+    return [row[1] for row in connection.execute(text(f"PRAGMA table_info({table})"))]
+
+
+def add_entry_log_date(connection):
+    if "log_date" not in _columns(connection, "entry"):
+        connection.execute(text("ALTER TABLE entry ADD COLUMN log_date DATE"))
+    # Backfill the day from date_logged. If a user somehow has two entries on the same day only the
+    # first one gets a log_date (it's the one get_daily_log always returned), the others are kept but
+    # left as NULL so the unique index can still be built
+    connection.execute(text(
+        "UPDATE entry SET log_date = date(date_logged) "
+        "WHERE log_date IS NULL AND date_logged IS NOT NULL AND id IN "
+        "(SELECT MIN(id) FROM entry WHERE date_logged IS NOT NULL GROUP BY user_id, date(date_logged))"
+    ))
+    connection.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS ix_entry_user_log_date ON entry (user_id, log_date)"))
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_item_entry_id ON item (entry_id)"))
+
+
+def add_item_encoding(connection):
+    # Existing items stay base64 (encoding 0) until convert_items() rewrites them
+    if "encoding" not in _columns(connection, "item"):
+        connection.execute(text("ALTER TABLE item ADD COLUMN encoding SMALLINT NOT NULL DEFAULT 0"))
+
+
+def add_entry_revision(connection):
+    columns = _columns(connection, "entry")
+    if "revision" not in columns:
+        connection.execute(text("ALTER TABLE entry ADD COLUMN revision INTEGER NOT NULL DEFAULT 0"))
+    if "updated_at" not in columns:
+        connection.execute(text("ALTER TABLE entry ADD COLUMN updated_at DATETIME"))
+    connection.execute(text("UPDATE entry SET updated_at = date_logged WHERE updated_at IS NULL"))
+
+
+def add_entry_updated_index(connection):
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_entry_user_updated_at ON entry (user_id, updated_at)"))
+
+
+def add_user_prefs_version(connection):
+    if "prefs_version" not in _columns(connection, "user"):
+        connection.execute(text('ALTER TABLE "user" ADD COLUMN prefs_version INTEGER NOT NULL DEFAULT 0'))
+
+
+def add_sync_changes(connection):
+    # Existing entries are numbered in the order of their updated_at, the best guess there is. The deleted
+    # entry table comes from create_all(), and the updated_at index isn't used by anything anymore
+    if "change_number" not in _columns(connection, "entry"):
+        connection.execute(text("ALTER TABLE entry ADD COLUMN change_number INTEGER"))
+    if "last_change" not in _columns(connection, "user"):
+        connection.execute(text('ALTER TABLE "user" ADD COLUMN last_change INTEGER NOT NULL DEFAULT 0'))
+    connection.execute(text(
+        "UPDATE entry SET change_number = numbered.number FROM "
+        "(SELECT id, ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY updated_at, id) AS number FROM entry) AS numbered "
+        "WHERE numbered.id = entry.id AND entry.change_number IS NULL"
+    ))
+    connection.execute(text(
+        'UPDATE "user" SET last_change = (SELECT COALESCE(MAX(change_number), 0) FROM entry WHERE entry.user_id = "user".id)'
+    ))
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_entry_user_change ON entry (user_id, change_number)"))
+    connection.execute(text("DROP INDEX IF EXISTS ix_entry_user_updated_at"))
+
+
+# The rebuilds below read items through the current Item model, so the item columns added by later
+# migrations have to exist before they run
+
+def add_search_index(connection):
+    add_item_encoding(connection)
+    # Virtual tables aren't models so create_all() doesn't know about them
+    connection.execute(text(search.CREATE_TABLE))
+    search.rebuild(connection)
+
+
+def add_mood_rollups(connection):
+    add_item_encoding(connection)
+    # The tables come from create_all(), they just need filling from the Happiness items already logged
+    mood.rebuild(connection)
+
+
+def add_day_index(connection):
+    # The table comes from create_all(), it's filled from the days already logged
+    dayindex.rebuild(connection)
+
+
+# Append new migrations to the end, the position in the list is the schema version
+MIGRATIONS = [
+    add_entry_log_date,
+    add_search_index,
+    add_mood_rollups,
+    add_item_encoding,
+    add_entry_revision,
+    add_day_index,
+    add_entry_updated_index,
+    add_user_prefs_version,
+    add_sync_changes,
+]
+
+
+def upgrade():
+    """Create missing tables and run every migration newer than the database's version.
+
+    Once the database is up to date this is a single PRAGMA, so it's cheap to call when every worker starts.
+    A new table needs a migration too (even one that does nothing) for this to notice it. Needs an app context.
+    :returns: The names of the migrations that ran, empty when the database was already up to date.
+    """
+    migrated = []
+    with db.engine.connect() as connection:
+        if connection.execute(text("PRAGMA user_version")).scalar() >= len(MIGRATIONS):
+            return migrated
+        with connection.begin():
+            # Takes the database's write lock before looking, so when several workers start at once one of
+            # them upgrades and the others wait for it (busy_timeout) and then find nothing left to do.
+            # Tables and columns are created in the same transaction, an upgrade that fails leaves nothing behind
+            connection.exec_driver_sql("BEGIN IMMEDIATE")
+            version = connection.execute(text("PRAGMA user_version")).scalar()
+            db.Model.metadata.create_all(connection)
+            for number, migration in enumerate(MIGRATIONS, start=1):
+                if number <= version:
+                    continue
+                migration(connection)
+                # PRAGMA doesn't accept bound parameters
+                connection.execute(text(f"PRAGMA user_version = {number}"))
+                current_app.logger.info(f"migrated database to version {number} ({migration.__name__})")
+                migrated.append(migration.__name__)
+    return migrated
+
+
+def convert_items(batch_size=1000):
+    """Rewrite base64 items in the compact formats of helpers.encode, batch_size items per transaction.
+
+    Safe to run while the site is up and to stop at any point: every batch is committed on its own, and an
+    item that was saved again in the meantime (so it's no longer base64) is left alone.
+    :returns: The number of items converted.
+    """
+    converted = 0
+    last_id = 0
+    statement = (update(Item.__table__)
+                 .where(Item.id == bindparam("item_id"), Item.encoding == BASE64)
+                 .values(encoding=bindparam("new_encoding"), content=bindparam("new_content")))
+    while True:
+        rows = db.session.execute(
+            select(Item.id, Item.content)
+            .where(Item.encoding == BASE64, Item.content.isnot(None), Item.id > last_id)
+            .order_by(Item.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            return converted
+        batch = []
+        for row in rows:
+            encoding, content = encode(decode(row.content))
+            batch.append({"item_id": row.id, "new_encoding": encoding, "new_content": content})
+        db.session.execute(statement, batch)
+        db.session.commit()
+        converted += len(batch)
+        last_id = rows[-1].id
@@ -0,0 +1,137 @@
+from datetime import datetime, date
+from flask_sqlalchemy import SQLAlchemy
+
+# The database is created without an app and bound in app.py through db.init_app(app), so that
+# other modules (like migrations.py) can import the models without importing app.py
+db = SQLAlchemy()
+
+
+class User(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    firstname = db.Column(db.String(25), nullable=False)
+    lastname = db.Column(db.String(25), nullable=False)
+    email =  db.Column(db.String(100), nullable=False, unique=True)
+    hash = db.Column(db.Text, nullable=False)
+    date_created = db.Column(db.DateTime, default=datetime.now())
+    # Bumped every time the user's preferences change, so the per process caches of them know to reload
+    prefs_version = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    # The last change number handed out to the user's entries, see sync.py
+    last_change = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    entries = db.relationship('Entry', backref='user', lazy=True)
+    prefs = db.relationship('Prefs', backref='user', lazy=True)
+
+    def __repr__(self):
+        return f"User('{self.firstname}', '{self.lastname}', '{self.email}')"
+
+
+class Entry(db.Model):
+    # (user_id, log_date) is how every day is looked up, so it gets a composite index. It's unique
+    # since a user only has one entry per day. Rows with no log_date (see migrations.py) are allowed
+    # to repeat since SQLite doesn't compare NULLs in unique indexes
+    # (user_id, change_number) is how sync clients of the API find the entries that changed
+    __table_args__ = (
+        db.Index('ix_entry_user_log_date', 'user_id', 'log_date', unique=True),
+        db.Index('ix_entry_user_change', 'user_id', 'change_number'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    # Passing the function (not datetime.now()) so the time is taken when the row is inserted
+    date_logged = db.Column(db.DateTime, default=datetime.now)
+    # Calendar day of the entry. Searching date_logged with LIKE '%YYYY-MM-DD%' can't use an index
+    log_date = db.Column(db.Date, default=date.today)
+    # Bumped every time the entry is saved, for ETags and for clients syncing changed days
+    revision = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    updated_at = db.Column(db.DateTime, default=datetime.now)
+    # Set by sync.py in the transaction that saves the entry, the order the API's sync clients see changes in
+    change_number = db.Column(db.Integer)
+    items = db.relationship('Item', backref = "entry", lazy=True)
+
+    def __repr__(self):
+        return f"Entry('Log {self.id}', '{self.log_date}')"
+
+# A day whose entry was deleted, with the change number of the deletion, so sync clients of the API learn
+# about it. Deleting the day again just renumbers its row
+class DeletedEntry(db.Model):
+    __table_args__ = (
+        db.Index('ix_deleted_entry_user_change', 'user_id', 'change_number'),
+    )
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    log_date = db.Column(db.Date, primary_key=True)
+    change_number = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return f"DeletedEntry('user_id {self.user_id}', '{self.log_date}', 'Change {self.change_number}')"
+
+# Item is all the items that were logged for a specific entry
+# Category is the type of item (e.x. description) for that entry. Each item type will have a unique
+# category, like (arbitrarily) lets say description had a category of 1
+class Item(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    category = db.Column(db.Integer, nullable=False)
+    # How content is stored, one of the formats in helpers.py (raw, zlib or the old base64)
+    encoding = db.Column(db.SmallInteger, nullable=False, default=0, server_default="0")
+    content = db.Column(db.LargeBinary)
+    entry_id = db.Column(db.Integer, db.ForeignKey('entry.id'), nullable = False, index=True)
+
+    def __repr__(self):
+        return f"Item('Type {self.category}', 'Entry {self.entry_id}', 'Content {self.content}'"
+
+# Preferences will store all the items selected for to be visible in the log menu for each user id
+# If a user decides to add an item in preferences, then we will db.session.add(Prefs(category=category, user_id = session["user_id"]))
+class Prefs(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    category = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+
+    def __repr__(self):
+        return f"Prefs('Type {self.category}', 'user_id {self.user_id}')"
+
+    def __init__(self, category, user_id):
+        self.category = category
+        self.user_id = user_id
+
+# The Happiness value of each day as a plain integer, written by mood.py when an entry is saved so that
+# mood trends never have to decode items
+class Mood(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    log_date = db.Column(db.Date, primary_key=True)
+    score = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return f"Mood('user_id {self.user_id}', '{self.log_date}', 'Score {self.score}')"
+
+# Average, lowest and highest mood of a user's week, month or year. period_start is the Monday of the
+# week, or the first day of the month/year
+class MoodRollup(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    period = db.Column(db.String(5), primary_key=True)
+    period_start = db.Column(db.Date, primary_key=True)
+    samples = db.Column(db.Integer, nullable=False)
+    total = db.Column(db.Integer, nullable=False)
+    lowest = db.Column(db.Integer, nullable=False)
+    highest = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return f"MoodRollup('user_id {self.user_id}', '{self.period} of {self.period_start}', 'Days {self.samples}')"
+
+# Days in a row that a user has recorded their mood
+class MoodStreak(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    current = db.Column(db.Integer, nullable=False)
+    longest = db.Column(db.Integer, nullable=False)
+    last_date = db.Column(db.Date, nullable=False)
+
+    def __repr__(self):
+        return f"MoodStreak('user_id {self.user_id}', 'Current {self.current}', 'Longest {self.longest}')"
+
+# Which days of a year a user logged, one bit per day of the year (bit 0 is January 1st) so a whole year
+# is 46 bytes. Kept up to date by dayindex.py for the calendar
+class DayIndex(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    year = db.Column(db.Integer, primary_key=True)
+    days = db.Column(db.LargeBinary, nullable=False)
+
+    def __repr__(self):
+        return f"DayIndex('user_id {self.user_id}', 'Year {self.year}')"
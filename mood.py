@@ -0,0 +1,202 @@
+import calendar
+from datetime import date, timedelta
+from sqlalchemy import delete, select, text
+
+from helpers import decode_item
+from models import db, Entry, Item, Mood, MoodRollup, MoodStreak
+
+# Mood trends for the Happiness item. Every save of a day's Happiness value goes through record(), which
+# keeps three things up to date in the same transaction as the save:
+#   mood: the day's value as an integer
+#   mood_rollup: the number of days, total, lowest and highest value of the week, month and year of that day
+#   mood_streak: the current and longest run of consecutive days with a value
+# Only the rollups that contain the saved day are recomputed (from at most a year of integers), and the
+# trend endpoints only ever read mood_rollup and mood_streak.
+
+CATEGORY = 2
+# The range of the Happiness slider, anything else isn't a score
+MIN_SCORE = 1
+MAX_SCORE = 100
+PERIODS = ("week", "month", "year")
+
+# The same period starts as period_bounds(), as SQLite expressions, for rebuilding every rollup at once
+_PERIOD_STARTS = {
+    "week": "date(log_date, 'weekday 0', '-6 days')",
+    "month": "date(log_date, 'start of month')",
+    "year": "date(log_date, 'start of year')",
+}
+
+
+def period_bounds(day, period):
+    """Get the first and last day (inclusive) of the week (starting Monday), month or year containing day."""
+    if period == "week":
+        start = day - timedelta(days=day.weekday())
+        return start, start + timedelta(days=6)
+    if period == "month":
+        return day.replace(day=1), day.replace(day=calendar.monthrange(day.year, day.month)[1])
+    return day.replace(month=1, day=1), day.replace(month=12, day=31)
+
+
+def parse_score(content):
+    """Turn the text of a Happiness input into its integer value, or None if it isn't one from MIN_SCORE to MAX_SCORE."""
+    try:
+        score = int(content)
+    except (TypeError, ValueError):
+        return None
+    return score if MIN_SCORE <= score <= MAX_SCORE else None
+
+
+def _refresh_rollup(user_id, period, day):
+    start, end = period_bounds(day, period)
+    params = {"user_id": user_id, "period": period, "start": start.isoformat(), "end": end.isoformat()}
+    db.session.execute(text(
+        "DELETE FROM mood_rollup WHERE user_id = :user_id AND period = :period AND period_start = :start"
+    ), params)
+    db.session.execute(text(
+        "INSERT INTO mood_rollup (user_id, period, period_start, samples, total, lowest, highest) "
+        "SELECT user_id, :period, :start, COUNT(*), SUM(score), MIN(score), MAX(score) FROM mood "
+        "WHERE user_id = :user_id AND log_date BETWEEN :start AND :end GROUP BY user_id"
+    ), params)
+
+
+def _streaks(days):
+    # Current (ending at the last day) and longest run of consecutive days in a sorted list of dates
+    current = longest = 0
+    previous = None
+    for day in days:
+        current = current + 1 if previous is not None and day - previous == timedelta(days=1) else 1
+        longest = max(longest, current)
+        previous = day
+    return current, longest
+
+
+def _rebuild_streak(user_id):
+    days = db.session.execute(
+        select(Mood.log_date).where(Mood.user_id == user_id).order_by(Mood.log_date)
+    ).scalars().all()
+    streak = MoodStreak.query.get(user_id)
+    if not days:
+        if streak is not None:
+            db.session.delete(streak)
+        return
+    current, longest = _streaks(days)
+    if streak is None:
+        streak = MoodStreak(user_id=user_id)
+        db.session.add(streak)
+    streak.current, streak.longest, streak.last_date = current, longest, days[-1]
+
+
+def _update_streak(user_id, day):
+    streak = MoodStreak.query.get(user_id)
+    if streak is None:
+        db.session.add(MoodStreak(user_id=user_id, current=1, longest=1, last_date=day))
+    elif day == streak.last_date + timedelta(days=1):
+        streak.current += 1
+        streak.longest = max(streak.longest, streak.current)
+        streak.last_date = day
+    elif day > streak.last_date:
+        streak.current = 1
+        streak.last_date = day
+
+
+def record(user_id, day, score):
+    """Save (or with score None, remove) a user's mood for a day and update their rollups and streak.
+
+    Runs in the current db.session transaction.
+    """
+    existing = Mood.query.get((user_id, day))
+    if score is None:
+        if existing is None:
+            return
+        db.session.delete(existing)
+    elif existing is None:
+        db.session.add(Mood(user_id=user_id, log_date=day, score=score))
+    else:
+        existing.score = score
+    db.session.flush()
+    for period in PERIODS:
+        _refresh_rollup(user_id, period, day)
+    # A new latest day only extends or restarts the streak, anything else (an edit of an older day or a
+    # removal) can change a run in the middle so the streak is worked out again
+    streak = MoodStreak.query.get(user_id)
+    if score is not None and (streak is None or day >= streak.last_date):
+        _update_streak(user_id, day)
+    else:
+        _rebuild_streak(user_id)
+
+
+def remove_user(user_id):
+    for model in (MoodRollup, MoodStreak, Mood):
+        db.session.execute(delete(model).where(model.user_id == user_id).execution_options(synchronize_session=False))
+
+
+def trends(user_id, period, limit):
+    """Get the latest limit rollups of a period (oldest first) and the user's streaks, ready for JSON."""
+    rollups = (MoodRollup.query.filter_by(user_id = user_id, period = period)
+               .order_by(MoodRollup.period_start.desc())
+               .limit(limit)
+               .all())
+    streak = MoodStreak.query.get(user_id)
+    current = longest = 0
+    if streak is not None:
+        longest = streak.longest
+        # The streak is only still going if the last day was today or yesterday
+        if streak.last_date >= date.today() - timedelta(days=1):
+            current = streak.current
+    return {
+        "period": period,
+        "points": [
+            {
+                "start": rollup.period_start.isoformat(),
+                "days": rollup.samples,
+                "average": round(rollup.total / rollup.samples, 1),
+                "lowest": rollup.lowest,
+                "highest": rollup.highest,
+            }
+            for rollup in reversed(rollups)
+        ],
+        "streak": {"current": current, "longest": longest},
+    }
+
+
+def rebuild(connection, user_id=None):
+    """Fill mood, mood_rollup and mood_streak from the Happiness items, for one user or everyone.
+
+    Used by migrations.py and after bulk imports, where going through record() a day at a time would be slow.
+    """
+    user_filter = "" if user_id is None else "WHERE user_id = :user_id"
+    params = {"user_id": user_id}
+    for table in ("mood", "mood_rollup", "mood_streak"):
+        connection.execute(text(f"DELETE FROM {table} {user_filter}"), params)
+
+    query = (select(Entry.user_id, Entry.log_date, Item.encoding, Item.content)
+             .join(Item, Item.entry_id == Entry.id)
+             .where(Item.category == CATEGORY, Entry.log_date.isnot(None)))
+    if user_id is not None:
+        query = query.where(Entry.user_id == user_id)
+    rows = []
+    for row in connection.execute(query):
+        score = parse_score(decode_item(row.encoding, row.content)) if row.content else None
+        if score is not None:
+            rows.append({"user_id": row.user_id, "log_date": row.log_date.isoformat(), "score": score})
+    if not rows:
+        return
+    connection.execute(text("INSERT OR REPLACE INTO mood (user_id, log_date, score) VALUES (:user_id, :log_date, :score)"), rows)
+
+    for period, start in _PERIOD_STARTS.items():
+        connection.execute(text(
+            "INSERT INTO mood_rollup (user_id, period, period_start, samples, total, lowest, highest) "
+            f"SELECT user_id, :period, {start}, COUNT(*), SUM(score), MIN(score), MAX(score) FROM mood "
+            f"{user_filter} GROUP BY user_id, {start}"
+        ), {"period": period, "user_id": user_id})
+
+    days_by_user = {}
+    for row in connection.execute(text(f"SELECT user_id, log_date FROM mood {user_filter} ORDER BY user_id, log_date"), params):
+        days_by_user.setdefault(row.user_id, []).append(date.fromisoformat(row.log_date))
+    streaks = []
+    for user, days in days_by_user.items():
+        current, longest = _streaks(days)
+        streaks.append({"user_id": user, "current": current, "longest": longest, "last_date": days[-1].isoformat()})
+    connection.execute(text(
+        "INSERT INTO mood_streak (user_id, current, longest, last_date) VALUES (:user_id, :current, :longest, :last_date)"
+    ), streaks)
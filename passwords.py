@@ -0,0 +1,96 @@
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from cache import LRUCache
+
+# Password hashing off the request threads. Hashes are worked out in a pool of processes so that a burst of
+# logins uses every core without starving the threads serving cheap pages, and the number of hashes waiting
+# for the pool is bounded so a login storm is turned away early instead of piling up.
+
+
+class HashingBusy(Exception):
+    """Raised when too many hashes are already waiting for the pool, or the pool couldn't answer in time."""
+
+
+class PasswordHasher:
+    def __init__(self, workers=None, iterations=260000, max_pending=64, timeout=10):
+        self.workers = workers or os.cpu_count() or 1
+        self.method = f"pbkdf2:sha256:{iterations}"
+        self.timeout = timeout
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        # Created on first use in each process, a pool inherited through a fork doesn't work
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                self._pid = os.getpid()
+            return self._executor
+
+    def _run(self, function, *args):
+        if not self._pending.acquire(timeout=self.timeout):
+            raise HashingBusy()
+        try:
+            executor = self._pool()
+            future = executor.submit(function, *args)
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            raise HashingBusy()
+        except BrokenProcessPool:
+            # A worker of the pool died (killed, out of memory), the pool is unusable so the next hash starts a new one
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+            executor.shutdown(wait=False)
+            raise HashingBusy()
+        finally:
+            self._pending.release()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """Check if a hash was made with another method or fewer iterations than configured.
+
+        Hashes with more iterations are kept, lowering the setting doesn't weaken them.
+        """
+        method = pwhash.split("$", 1)[0].split(":")
+        configured = self.method.split(":")
+        if method[:2] != configured[:2]:
+            return True
+        # A method without an iteration count is from an old werkzeug default, count it as fewer
+        iterations = int(method[2]) if len(method) > 2 and method[2].isdigit() else 0
+        return iterations < int(configured[2])
+
+
+class Throttle:
+    """Allows attempts per key (an email or IP) at a steady rate, with bursts of up to attempts at once."""
+
+    def __init__(self, attempts, period):
+        self.attempts = attempts
+        self.rate = attempts / period
+        # Buckets that are left alone for a period are full again, so they can be forgotten
+        self.buckets = LRUCache(maxsize=100000, ttl=period)
+        self._lock = threading.Lock()
+
+    def allow(self, key):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self.buckets.get(key, (self.attempts, now))
+            tokens = min(self.attempts, tokens + (now - updated) * self.rate)
+            if tokens < 1:
+                self.buckets.set(key, (tokens, now))
+                return False
+            self.buckets.set(key, (tokens - 1, now))
+            return True
@@ -0,0 +1,145 @@
+import re
+from datetime import date
+from markupsafe import Markup, escape
+from sqlalchemy import column, delete, select, table, text
+
+from helpers import decode_item
+from models import db, Entry, Item
+
+# Keyword search over the decoded text of a user's items. Item.content can be compressed (or base64 for
+# old items) so SQL can't look inside it, instead the decoded text is copied into an SQLite FTS5 table (item_search) whose rowid is
+# the item's id. The table is kept up to date by calling index_items() whenever items are saved.
+
+# Summary and Location, the items with text worth searching (Happiness is just a number)
+SEARCHABLE_CATEGORIES = (1, 3)
+RESULTS_PER_PAGE = 10
+
+# The owner column holds a single token (u<user_id>) so that matching a user's items is part of the
+# full-text lookup itself instead of a filter over every user's matches
+CREATE_TABLE = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS item_search USING fts5("
+    "content, owner, user_id UNINDEXED, category UNINDEXED, log_date UNINDEXED, "
+    "tokenize = 'porter unicode61')"
+)
+
+# Lightweight table so deletes can be built with subqueries. item_search isn't a model since it's virtual
+_search_table = table("item_search", column("rowid"))
+
+_INSERT = text(
+    "INSERT INTO item_search (rowid, content, owner, user_id, category, log_date) "
+    "VALUES (:id, :content, :owner, :user_id, :category, :log_date)"
+)
+
+# Characters that can't show up in diary text, used to mark highlights in snippets before escaping
+_MARK_START = "\x02"
+_MARK_END = "\x03"
+
+
+def _owner(user_id):
+    return f"u{user_id}"
+
+
+def _rows(entry, items):
+    for item in items:
+        if item.category not in SEARCHABLE_CATEGORIES or not item.content:
+            continue
+        yield {
+            "id": item.id,
+            "content": decode_item(item.encoding, item.content),
+            "owner": _owner(entry.user_id),
+            "user_id": entry.user_id,
+            "category": item.category,
+            "log_date": entry.log_date.isoformat(),
+        }
+
+
+def index_items(entry, items):
+    """Add or replace the search rows of an entry's items.
+
+    Runs in the current db.session transaction, so it's committed (or rolled back) with the items.
+    The items must have been flushed so that they have ids.
+    """
+    ids = [{"id": item.id} for item in items]
+    if ids:
+        db.session.execute(text("DELETE FROM item_search WHERE rowid = :id"), ids)
+    rows = list(_rows(entry, items))
+    if rows:
+        db.session.execute(_INSERT, rows)
+
+
+def remove_items(item_ids):
+    """Delete the search rows of the items whose ids are selected by item_ids (a select() of Item.id)."""
+    db.session.execute(delete(_search_table).where(_search_table.c.rowid.in_(item_ids)))
+
+
+def _index_query(connection, query):
+    rows = []
+    for row in connection.execute(query):
+        if not row.content:
+            continue
+        rows.append({"id": row.id, "content": decode_item(row.encoding, row.content), "owner": _owner(row.user_id),
+                     "user_id": row.user_id, "category": row.category, "log_date": row.log_date.isoformat()})
+        if len(rows) == 1000:
+            connection.execute(_INSERT, rows)
+            rows = []
+    if rows:
+        connection.execute(_INSERT, rows)
+
+
+def _items_query():
+    return (select(Entry.user_id, Entry.log_date, Item.id, Item.category, Item.encoding, Item.content)
+            .join(Item, Item.entry_id == Entry.id)
+            .where(Item.category.in_(SEARCHABLE_CATEGORIES), Entry.log_date.isnot(None)))
+
+
+def index_entries(entry_ids):
+    """Add the search rows of every item of newly inserted entries, used by bulk imports."""
+    _index_query(db.session.connection(), _items_query().where(Entry.id.in_(entry_ids)))
+
+
+def rebuild(connection):
+    """Fill item_search from scratch with every item in the database, used by migrations.py."""
+    connection.execute(text("DELETE FROM item_search"))
+    _index_query(connection, _items_query())
+
+
+def _match_expression(user_id, query):
+    # Every word the user typed is quoted so that FTS5 operators and punctuation in the search box are
+    # taken literally, and the last one matches as a prefix so results show up while a word is half typed
+    words = re.findall(r"\w+", query)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += "*"
+    return f"owner:{_owner(user_id)} AND content:({' '.join(terms)})"
+
+
+def _highlight(snippet):
+    return Markup(str(escape(snippet)).replace(_MARK_START, "<mark>").replace(_MARK_END, "</mark>"))
+
+
+def search(user_id, query, page=1):
+    """Find the user's items containing every word of query, best match first.
+
+    :returns: A (results, has_next) tuple where results is a list of dicts with the item's entry date,
+        category, and an escaped snippet with the matches highlighted.
+    """
+    expression = _match_expression(user_id, query)
+    if expression is None:
+        return [], False
+    rows = db.session.execute(text(
+        "SELECT log_date, category, "
+        f"snippet(item_search, 0, '{_MARK_START}', '{_MARK_END}', '...', 16) AS snippet "
+        "FROM item_search WHERE item_search MATCH :expression "
+        "ORDER BY bm25(item_search) LIMIT :limit OFFSET :offset"
+    ), {
+        "expression": expression,
+        # One extra row tells us if there's another page without counting every match
+        "limit": RESULTS_PER_PAGE + 1,
+        "offset": (page - 1) * RESULTS_PER_PAGE,
+    }).all()
+    results = [
+        {"log_date": date.fromisoformat(row.log_date), "category": row.category, "snippet": _highlight(row.snippet)}
+        for row in rows[:RESULTS_PER_PAGE]
+    ]
+    return results, len(rows) > RESULTS_PER_PAGE
@@ -0,0 +1,177 @@
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+from cache import LRUCache
+
+# Server side sessions. The cookie only holds a random session id and the data lives in a store:
+#   "memory": an LRU dictionary inside the process, the fastest but only for a single worker
+#   "sqlite": a table in its own SQLite file, shared by every worker on the host and kept across restarts
+# Set with app.config["SESSION_BACKEND"] and installed with init_app(app). Expired sessions are removed
+# by a background thread every SESSION_SWEEP_INTERVAL seconds.
+
+
+class StoredSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, expires=None):
+        def on_update(self):
+            self.modified = True
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.expires = expires
+        self.modified = False
+        # The id this session had before regenerate(), removed from the store when the session is saved
+        self.previous_sid = None
+
+    def regenerate(self):
+        """Move the session to a new id, call when the user logs in so an id handed out before can't be used."""
+        if self.previous_sid is None:
+            self.previous_sid = self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.modified = True
+
+
+class MemoryStore:
+    def __init__(self, maxsize, lifetime):
+        self.sessions = LRUCache(maxsize=maxsize, ttl=lifetime)
+
+    def load(self, sid):
+        return self.sessions.get(sid)
+
+    def save(self, sid, data, expires):
+        self.sessions.set(sid, (data, expires))
+
+    def delete(self, sid):
+        self.sessions.pop(sid)
+
+    def sweep(self):
+        self.sessions.expire()
+
+
+class SQLiteStore:
+    def __init__(self, path):
+        self.path = path
+        # sqlite3 connections can't be shared between threads, so every thread opens its own
+        self.local = threading.local()
+        self._connect().execute(
+            "CREATE TABLE IF NOT EXISTS session (sid TEXT PRIMARY KEY, data TEXT NOT NULL, expires REAL NOT NULL) WITHOUT ROWID"
+        )
+        self._connect().execute("CREATE INDEX IF NOT EXISTS ix_session_expires ON session (expires)")
+
+    def _connect(self):
+        connection = getattr(self.local, "connection", None)
+        # A forked worker must not reuse its parent's connection
+        if connection is None or self.local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = NORMAL")
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return connection
+
+    def load(self, sid):
+        row = self._connect().execute(
+            "SELECT data, expires FROM session WHERE sid = ? AND expires > ?", (sid, time.time())
+        ).fetchone()
+        return row
+
+    def save(self, sid, data, expires):
+        self._connect().execute("INSERT OR REPLACE INTO session (sid, data, expires) VALUES (?, ?, ?)", (sid, data, expires))
+
+    def delete(self, sid):
+        self._connect().execute("DELETE FROM session WHERE sid = ?", (sid,))
+
+    def sweep(self):
+        self._connect().execute("DELETE FROM session WHERE expires <= ?", (time.time(),))
+
+
+class StoredSessionInterface(SessionInterface):
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, store, lifetime, sweep_interval):
+        self.store = store
+        self.lifetime = lifetime
+        self.sweep_interval = sweep_interval
+        self._sweeper_pid = None
+
+    def _start_sweeper(self):
+        # Threads don't survive a fork, so each worker process starts its own sweeper the first time it
+        # handles a request
+        if self._sweeper_pid == os.getpid():
+            return
+        self._sweeper_pid = os.getpid()
+
+        def sweep_forever():
+            while True:
+                time.sleep(self.sweep_interval)
+                try:
+                    self.store.sweep()
+                except sqlite3.Error:
+                    # The next sweep will get it, most likely the database was busy
+                    pass
+
+        threading.Thread(target=sweep_forever, name="session-sweeper", daemon=True).start()
+
+    def open_session(self, app, request):
+        self._start_sweeper()
+        sid = request.cookies.get(app.session_cookie_name)
+        if sid:
+            stored = self.store.load(sid)
+            if stored is not None:
+                data, expires = stored
+                if expires > time.time():
+                    return StoredSession(self.serializer.loads(data), sid=sid, expires=expires)
+        return StoredSession(sid=secrets.token_urlsafe(32))
+
+    def save_session(self, app, session, response):
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.previous_sid is not None:
+            self.store.delete(session.previous_sid)
+            session.previous_sid = None
+        if not session:
+            # Cleared (logged out) or never used, nothing needs to be stored
+            if session.modified:
+                self.store.delete(session.sid)
+                response.delete_cookie(app.session_cookie_name, domain=domain, path=path)
+            return
+
+        now = time.time()
+        # Unchanged sessions are only written again once half their lifetime has passed, which keeps
+        # active users logged in without a write on every request
+        if not session.modified and session.expires is not None and session.expires - now > self.lifetime / 2:
+            return
+        session.expires = now + self.lifetime
+        self.store.save(session.sid, self.serializer.dumps(dict(session)), session.expires)
+        response.set_cookie(
+            app.session_cookie_name,
+            session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+
+
+def regenerate(session):
+    """Give session a new id if it's one of these server side sessions (the filesystem backend keeps its id)."""
+    if isinstance(session, StoredSession):
+        session.regenerate()
+
+
+def init_app(app):
+    backend = app.config["SESSION_BACKEND"]
+    lifetime = app.permanent_session_lifetime.total_seconds()
+    if backend == "memory":
+        store = MemoryStore(app.config.get("SESSION_MEMORY_SIZE", 10000), lifetime)
+    elif backend == "sqlite":
+        store = SQLiteStore(app.config.get("SESSION_SQLITE_PATH", os.path.join(app.root_path, "sessions.db")))
+    else:
+        raise ValueError(f"Unknown session backend {backend!r}, use 'memory' or 'sqlite'")
+    app.session_interface = StoredSessionInterface(store, lifetime, app.config.get("SESSION_SWEEP_INTERVAL", 300))
@@ -0,0 +1,31 @@
+from sqlalchemy import insert, select, update
+
+from models import db, DeletedEntry, User
+
+# Change numbers for the sync clients of the API. Every entry that is saved, imported or deleted takes the
+# next number of its user's counter (User.last_change) inside the transaction that writes it. The counter is
+# bumped with an UPDATE, which holds SQLite's write lock until the commit, so numbers follow the order the
+# transactions commit in whatever the clock says, and a client that has every change up to a number never
+# misses one that commits later. Deleted days are kept in deleted_entry with the number of their deletion.
+
+
+def next_changes(user_id, count=1):
+    """Reserve count change numbers for a user in the current db.session transaction.
+
+    :returns: The first of the numbers, the others follow it.
+    """
+    db.session.execute(
+        update(User).where(User.id == user_id).values(last_change=User.last_change + count)
+        .execution_options(synchronize_session=False)
+    )
+    return db.session.execute(select(User.last_change).where(User.id == user_id)).scalar() - count + 1
+
+
+def record_deletions(user_id, days):
+    """Keep a tombstone with a new change number for each of the user's deleted days. Runs in the current transaction."""
+    if not days:
+        return
+    first = next_changes(user_id, len(days))
+    db.session.execute(insert(DeletedEntry).prefix_with("OR REPLACE"), [
+        {"user_id": user_id, "log_date": day, "change_number": first + number} for number, day in enumerate(days)
+    ])
@@ -0,0 +1,560 @@
+from flask import Blueprint, Response, current_app, flash, get_template_attribute, jsonify, redirect, render_template, request, session, stream_with_context
+from werkzeug.exceptions import default_exceptions, HTTPException, InternalServerError
+from datetime import datetime, date, timedelta, timezone
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
+
+import caching
+import database
+import dayindex
+import mood
+import search
+import sessions
+import sync
+from helpers import login_required, encode, date_window
+from history import delete_history, export_rows, import_entries, jsonl_chunks, csv_chunks, gzip_chunks, DELETE_CHUNK_SIZE
+from items import Summary, Happiness, Location
+from models import db, User, Entry, Item, Prefs
+from passwords import HashingBusy
+
+# Every page of the website. create_app() in app.py registers the blueprint, and keeps the objects built
+# from the app's config (the password hasher and the prerendered log form) in app.extensions
+main = Blueprint("main", __name__)
+
+all_items = {
+    1:Summary(),
+    2:Happiness(),
+    3:Location()
+}
+
+# The caches and login throttles below are built by create_app() and kept in app.extensions, so every app
+# in a process has its own
+
+
+def password_hasher():
+    return current_app.extensions["password_hasher"]
+
+def get_preferred_items(user_id):
+    # Each user's preferred item categories as a sorted tuple, so a page view doesn't have to query Prefs.
+    # The cache is per process, so User.prefs_version (bumped in the same transaction as every change of the
+    # preferences) is stored next to the categories. Checking it is a primary key lookup, and a worker holding
+    # a copy from another version reloads it, whichever session or device made the change.
+    preferences_cache = current_app.extensions["preferences_cache"]
+    version = db.session.execute(select(User.prefs_version).where(User.id == user_id)).scalar()
+    cached = preferences_cache.get(user_id)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    preferences = Prefs.query.filter_by(user_id = user_id).order_by(Prefs.category).all()
+    preferred_items = tuple(preference.category for preference in preferences)
+    preferences_cache.set(user_id, (version, preferred_items))
+    return preferred_items
+
+def item_names():
+    # The key each item's content has in exported and imported files
+    return {category: item.name.lower() for category, item in all_items.items()}
+
+def get_login_user(email):
+    # Email -> user id of recent logins. The hash isn't cached, it's read by primary key on every attempt so
+    # a hash upgraded by another worker is seen straight away
+    login_users = current_app.extensions["login_users"]
+    user_id = login_users.get(email)
+    if user_id is not None:
+        user_hash = db.session.execute(select(User.hash).where(User.id == user_id)).scalar()
+        if user_hash is not None:
+            return user_id, user_hash
+    user = User.query.filter(User.email==email).first()
+    if user is None:
+        return None
+    login_users.set(email, user.id)
+    return user.id, user.hash
+
+def get_daily_log():
+    return Entry.query.filter_by(user_id = session["user_id"], log_date = date.today()).first()
+
+def get_entry_versions(user_id, start, end):
+    # Just the ids, dates and revisions of the entries from start to end (inclusive) and the ids of their
+    # items, enough to build an ETag without loading any content
+    return db.session.execute(
+        select(Entry.id, Entry.log_date, Entry.revision, Entry.updated_at, Item.id.label("item_id"))
+        .outerjoin(Item, Item.entry_id == Entry.id)
+        .where(Entry.user_id == user_id, Entry.log_date.between(start, end))
+        .order_by(Entry.log_date, Item.id)
+    ).all()
+
+def get_entries(entry_ids):
+    # The entries with their items joined in, so a whole window is one query however many days it covers
+    return Entry.query.options(joinedload(Entry.items)).filter(Entry.id.in_(entry_ids)).all()
+
+@main.route("/", methods = ["GET", "POST"])
+@login_required
+def index():
+    deleteOption = False
+    # This will only be called if deleteOption is true since that will active a form
+    if request.method == "POST":
+        deleted_entries, deleted_items = delete_history(session["user_id"], DELETE_CHUNK_SIZE)
+        current_app.logger.info(f"deleted {deleted_entries} entries and {deleted_items} items of user {session['user_id']}")
+        return redirect("/")
+    else:
+        user = User.query.filter_by(id=session["user_id"]).first()
+        firstname = user.firstname.capitalize()
+        userdate = user.date_created.date().strftime("%Y-%m-%d")
+        todaysdate = datetime.now().strftime('%Y-%m-%d')
+        firsttime = True
+        hasLogged = False
+        if userdate != todaysdate:
+            firsttime = False
+        daily_log = get_daily_log()
+        if daily_log:
+            hasLogged = True
+        return render_template("index.html", firstname = firstname, firsttime = firsttime, hasLogged = hasLogged, deleteOption = deleteOption)
+
+
+@main.route("/login", methods=["GET", "POST"])
+def login():
+    if request.method == "POST":
+        email = request.form.get("email")
+        password = request.form.get("password")
+
+        # Attempts allowed per minute by email and by IP, checked before any hashing is done
+        email_throttle, ip_throttle = current_app.extensions["email_throttle"], current_app.extensions["ip_throttle"]
+        if not (email_throttle.allow((email or "").lower()) and ip_throttle.allow(request.remote_addr)):
+            flash("Too many login attempts. Please wait a minute and try again.", category="error")
+            return render_template("login.html", email=email)
+
+        # SQLAlchemy's way of SELECTing, through query. The User is the class/table
+        # defined above, then we query it WHERE email (User.email) is email(request.form.get("email"))
+        # and then select the first row. get_login_user keeps the ids of recent logins
+        user = get_login_user(email)
+        if user is None:
+            flash("No account registered with that email", category="error")
+            return redirect("/login")
+        user_id, user_hash = user
+
+        # Check password hash
+        try:
+            correct = password_hasher().verify(user_hash, password)
+        except HashingBusy:
+            flash("DiaryLite is busy, please try logging in again in a moment.", category="error")
+            return render_template("login.html", email=email)
+        if not correct:
+            flash("Incorrect password", category="error")
+            # Sends email to login.html to preserve input fields when reloading the page
+            return render_template("login.html", email=email)
+
+        # Hashes made with older settings are replaced now that we have the password
+        if password_hasher().needs_rehash(user_hash):
+            try:
+                new_hash = password_hasher().hash(password)
+                with database.writer():
+                    User.query.filter_by(id=user_id).update({"hash": new_hash})
+                    db.session.commit()
+            except HashingBusy:
+                pass
+
+        # Remember which user has logged in, under a new session id
+        sessions.regenerate(session)
+        session["user_id"] = user_id
+
+        flash("Logged in", category="success")
+
+        # Redirect user to home page
+        return redirect("/")
+
+    else:
+        return render_template("login.html")
+
+
+@main.route("/logout")
+def logout():
+    session.clear()
+
+    # Redirect user to login form
+    return redirect("/")
+
+
+@main.route("/register", methods=["GET", "POST"])
+def register():
+    if request.method == "POST":
+        # Boolean that when true will have password checks. Good for testing.
+        checkPassword = True
+        # Declarations so we don't have to keep typing request.form.get
+        firstname = request.form.get("firstname")
+        lastname = request.form.get("lastname")
+        password = request.form.get("password")
+        email = request.form.get("email")
+        confirmation = request.form.get("confirmation")
+
+        # Database has max length of 25 for firstname and lastname and 100 for email
+        if len(firstname) > 25:
+            flash("Firstname has a maximum length of 25 characters.", category="error")
+            return render_template("register.html", lastname = lastname, email = email, password = password)
+        if len(lastname) > 25:
+            flash("Lastname has a maximum length of 25 characters.", category="error")
+            return render_template("register.html", firstname = firstname, email = email, password = password)
+        if len(email) > 100:
+            flash("Email has a maximum length of 100 characters.", category="error")
+            return render_template("register.html", firstname = firstname, lastname = lastname, password = password)
+        # Password checks:
+        if checkPassword:
+            if len(password) < 8:
+                flash("Password must be at least 8 characters", category="error")
+                return render_template("register.html", firstname = firstname, lastname = lastname, email = email)
+            if password != confirmation:
+                flash("Passwords do not match", category="error")
+                return render_template("register.html", firstname = firstname, lastname = lastname, email = email)
+
+            # Checks for numbers in password
+            if not any(character.isnumeric() for character in password):
+                flash("Password must contain a number", category="error")
+                return render_template("register.html", firstname = firstname, lastname = lastname, email = email)
+                
+            
+            # Checks for both uppercase and lowercase characters 
+            if not (any(letter.islower() for letter in password) and any(letter.isupper() for letter in password)):
+                flash("Password must contain both uppercase and lowercase letters", category="error")
+                return render_template("register.html", firstname = firstname, lastname = lastname, email = email)
+            
+
+        users = User.query.filter_by(email=email).all()
+        if(len(users) != 0):
+            flash("User with the same email already exists", category="error")
+            return render_template("register.html", firstname = firstname, lastname = lastname, password = password)
+
+        if not current_app.extensions["ip_throttle"].allow(request.remote_addr):
+            flash("Too many attempts. Please wait a minute and try again.", category="error")
+            return render_template("register.html", firstname = firstname, lastname = lastname, email = email)
+        try:
+            password_hash = password_hasher().hash(password)
+        except HashingBusy:
+            flash("DiaryLite is busy, please try registering again in a moment.", category="error")
+            return render_template("register.html", firstname = firstname, lastname = lastname, email = email)
+
+        user = User(firstname=firstname, lastname=lastname, email=email, hash=password_hash)
+        with database.writer():
+            db.session.add(user)
+            db.session.commit()
+            # Setting default on preferences for a new user being summary and slider
+            pref1 = Prefs(1, user.id)
+            pref2 = Prefs(2, user.id)
+            db.session.add(pref1)
+            db.session.add(pref2)
+            db.session.commit()
+
+        
+        sessions.regenerate(session)
+        flash("Registered", category="success")
+        session["user_id"] = user.id
+
+        return redirect("/")
+    else:
+        return render_template("register.html")
+
+# Steps for creating a new item:
+# Create new item class in items.py with everything you need including the custom html/disabledhtml. Make sure to have appropriate name and id
+# Import the name of the item at the top of views.py
+# Add item and corresponding category to all_items
+# Set deleteOption in app.route("/") to be true and delete all entries
+
+@main.route("/log", methods = ["GET", "POST"])
+@login_required
+def log():
+    hasLogged = False
+    items = None
+    daily_log = get_daily_log()
+    if daily_log:
+        hasLogged = True
+        items = Item.query.filter(Item.entry_id == daily_log.id).all()
+    readable_date = datetime.today().strftime('%A %B %d, %Y')
+    preferred_items = get_preferred_items(session["user_id"])
+    if request.method == "POST":
+        # Checked like imports are, a value the slider can't send would end up in the mood trends
+        happiness = None
+        if mood.CATEGORY in preferred_items:
+            happiness_box = request.form.get(all_items[mood.CATEGORY].name.lower()+"box", "").strip()
+            happiness = mood.parse_score(happiness_box)
+            if happiness_box and happiness is None:
+                flash(f"Happiness must be a number from {mood.MIN_SCORE} to {mood.MAX_SCORE}.", category="error")
+                return redirect("/log")
+        # The whole save is one unit of work: the entry, every item and the search rows are flushed
+        # together and committed once, so a save is a single transaction however many items there are
+        entry = daily_log
+        if entry is None:
+            now = datetime.now()
+            entry = Entry(user_id = session["user_id"], date_logged = now, log_date = now.date())
+            db.session.add(entry)
+        saved_items = {item.category: item for item in items or []}
+        # Items that are no longer preferred are kept but emptied
+        for category, item in saved_items.items():
+            if category not in preferred_items:
+                item.content = None
+        # Content will store the content of an item for that entry. '---' indicates a new input field in the case of some items having multiple inputs. This will be used to set values in memory_results
+        new_items = []
+        for category in preferred_items:
+            # input_box is the name of the box we are searching for. So for summary that's "summarybox"
+            # We get the value (class) at all_items with key of category
+            input_box = all_items[category].name.lower()+"box"
+            encoding, encoded_content = encode(request.form.get(input_box, ""))
+            if category in saved_items:
+                saved_items[category].encoding = encoding
+                saved_items[category].content = encoded_content
+            else:
+                new_items.append(Item(category = category, encoding = encoding, content = encoded_content, entry = entry))
+        db.session.add_all(new_items)
+        entry.revision = (entry.revision or 0) + 1
+        entry.updated_at = datetime.now()
+        with database.writer():
+            try:
+                # Numbered while holding the database's write lock, so sync clients see saves in commit order
+                entry.change_number = sync.next_changes(entry.user_id)
+                # Flushing gives the new rows their ids, which the search index needs
+                db.session.flush()
+                search.index_items(entry, list(saved_items.values()) + new_items)
+                mood.record(entry.user_id, entry.log_date, happiness)
+                if not hasLogged:
+                    dayindex.mark(entry.user_id, entry.log_date)
+                db.session.commit()
+            except IntegrityError:
+                # Another request created today's entry first (the (user_id, log_date) index is unique)
+                db.session.rollback()
+                flash("Your entry was saved from somewhere else at the same time. Please try again.", category="error")
+                return redirect("/log")
+        caching.forget_day(entry.user_id, entry.log_date)
+        if hasLogged:
+            flash("Updated journal entry.")
+        else:
+            flash("Logged new journal entry. ")
+        return redirect("/")
+
+                
+    else:
+        return render_template("log.html", log_form = current_app.extensions["log_form"].render(preferred_items), preferred_items = preferred_items, all_items = all_items, hasLogged = hasLogged, logged_items = items, date = readable_date)
+
+
+@main.route("/prefs", methods=["GET", "POST"])
+@login_required
+def prefs():
+    if request.method == "POST":
+        # Iterates through all possible items and if the checkbox with the name of the lowercase item name is checked (not None) 
+        # then we add it to the preferred items list. 
+        preferred_items = [category for category in all_items if request.form.get(all_items[category].name.lower())]
+        # Delete all current preferences linked to the id since 'Update Preferences' button was hit
+        with database.writer():
+            Prefs.query.filter_by(user_id = session["user_id"]).delete()
+            # Iterate through the items in our preferred list and add them back to the base
+            for item in preferred_items:
+                new_pref = Prefs(item, session["user_id"])
+                db.session.add(new_pref)
+            User.query.filter_by(id = session["user_id"]).update({"prefs_version": User.prefs_version + 1})
+
+            db.session.commit()
+        # The new version makes every worker reload this user's preferences, this one just drops its copy
+        current_app.extensions["preferences_cache"].pop(session["user_id"])
+        flash("Updated Preferences", category="success")
+        return redirect("/")
+    else:
+        preferred_items = get_preferred_items(session["user_id"])
+        return render_template("prefs.html", preferred_items = preferred_items, all_items = all_items)
+
+# Memories will just contain the search option, whereas memories/view will appear with the relevant entries that can be viewed
+@main.route("/memories")
+@login_required
+def memories():
+    return render_template("memories.html")
+
+@main.route("/calendar")
+@login_required
+def calendar_view():
+    # A month of the calendar (this month by default) with the logged days marked, and the entries of
+    # today's date in earlier years
+    today = date.today()
+    year = request.args.get("year", today.year, type=int)
+    month = request.args.get("month", today.month, type=int)
+    # The grid of December 9999 would run into January 10000, which a date can't be
+    if not 1 <= month <= 12 or not 1 <= year <= 9998:
+        year, month = today.year, today.month
+    first = date(year, month, 1)
+    # Worked out from month numbers so the first and last months don't overflow, they just don't link any further
+    months = year * 12 + month - 1
+    previous_month = date((months - 1) // 12, (months - 1) % 12 + 1, 1) if (months - 1) // 12 >= 1 else None
+    next_month = date((months + 1) // 12, (months + 1) % 12 + 1, 1) if (months + 1) // 12 <= 9998 else None
+    return render_template("calendar.html", first = first, weeks = dayindex.month(session["user_id"], year, month),
+                           previous_month = previous_month, next_month = next_month, today = today,
+                           past_entries = dayindex.on_this_day(session["user_id"], today), all_items = all_items)
+
+@main.route("/search")
+@login_required
+def search_memories():
+    query = request.args.get("q", "").strip()
+    page = request.args.get("page", 1, type=int)
+    if page < 1:
+        page = 1
+    results, has_next = search.search(session["user_id"], query, page) if query else ([], False)
+    return render_template("search.html", query = query, results = results, page = page, has_next = has_next, all_items = all_items)
+
+# How many weeks, months or years the mood chart shows by default
+MOOD_POINTS = {"week": 26, "month": 24, "year": 10}
+
+@main.route("/mood")
+@login_required
+def mood_chart():
+    return render_template("mood.html")
+
+@main.route("/mood/trends")
+@login_required
+def mood_trends():
+    # Only reads the rollups, so it costs the same however long the user has been logging
+    period = request.args.get("period", "week")
+    if period not in MOOD_POINTS:
+        return jsonify(error="period must be week, month or year"), 400
+    limit = min(max(request.args.get("limit", MOOD_POINTS[period], type=int), 1), 500)
+    return jsonify(mood.trends(session["user_id"], period, limit))
+
+@main.route("/export")
+@login_required
+def export():
+    # Streams the whole diary while it's being read from the database, a page of entries at a time
+    export_format = request.args.get("format", "jsonl")
+    if export_format not in ("jsonl", "csv"):
+        flash("Export format must be jsonl or csv", category="error")
+        return redirect("/memories")
+    rows = export_rows(session["user_id"], item_names())
+    if export_format == "csv":
+        chunks = csv_chunks(rows, ["date", "logged_at"] + list(item_names().values()))
+        mimetype = "text/csv"
+    else:
+        chunks = jsonl_chunks(rows)
+        mimetype = "application/x-ndjson"
+    filename = f"diarylite-{date.today().isoformat()}.{export_format}"
+    if request.args.get("gzip"):
+        chunks = gzip_chunks(chunks)
+        mimetype = "application/gzip"
+        filename += ".gz"
+    response = Response(stream_with_context(chunks), mimetype=mimetype)
+    response.headers["Content-Disposition"] = f"attachment; filename={filename}"
+    return response
+
+@main.route("/import", methods=["GET", "POST"])
+@login_required
+def import_diary():
+    if request.method == "POST":
+        upload = request.files.get("file")
+        if not upload or not upload.filename:
+            flash("Choose a file to import", category="error")
+            return redirect("/import")
+        report = import_entries(session["user_id"], upload.stream, item_names())
+        if report["invalid"]:
+            flash(f"{report['invalid']} lines couldn't be imported. " + " ".join(report["errors"][:3]), category="error")
+        flash(f"Imported {report['imported']} entries in {report['seconds']} seconds, skipped {report['duplicates']} days you had already logged.")
+        return redirect("/memories")
+    else:
+        return render_template("import.html")
+
+@main.route("/results", methods = ["GET", "POST"])
+@login_required
+def results():
+    # GET (from the memories form and links) can be cached by the browser, POST is still accepted
+    user_date = request.values.get("searchbar", "").strip()
+    if user_date:
+        if user_date.lower() == "today":
+            todays_date = datetime.now()
+            user_date = datetime.strftime(todays_date, "%m %d %Y")
+        elif user_date.lower() == "yesterday":
+            yesterdays_date = datetime.now() - timedelta(days=1)
+            user_date = datetime.strftime(yesterdays_date, "%m %d %Y")
+        
+        # Check if the user inputted like m-d-y or m/d/y
+        times = ""
+        if "-" in user_date:
+            times = user_date.split("-")
+        elif "/" in user_date:
+            times = user_date.split("/")
+        else:
+            times = user_date.split()
+
+        # Make sure there is and only is year month and year
+        if len(times) != 3:
+            flash("Input must be comprised of the year, month, and date", category = "error")
+            return redirect("/memories")
+
+        # Make sure all characters are numeric
+        for time in times:
+            if not time.isnumeric():
+                flash("Input must be formatted using only '-', '/', ' ', and numbers", category = "error")
+                return redirect("/memories")
+        
+        times[0] = times[0].zfill(2)
+        if len(times[0]) != 2:
+            flash("Invalid length for month", category = "error")
+            return redirect("/memories")
+        elif int(times[0]) < 0 or int(times[0]) > 12:
+            flash("Invalid value for month", category = "error")
+            return redirect("/memories")
+
+        times[1] = times[1].zfill(2)
+        if len(times[1]) != 2:
+            flash("Invalid length for day", category = "error")
+            return redirect("/memories")
+        elif int(times[1]) < 0 or int(times[1]) > 31:
+            flash("Invalid value for day", category = "error")
+            return redirect("/memories")
+        n = len(times[2])
+        if n != 2 and n != 4:
+            flash("Invalid length for year", category = "error")
+            return redirect("/memories")
+        if n == 2:
+            # Just adds for example 20 to the front in the year 2021 by getting first two digits of current year
+            times[2] = str(int(datetime.now().year / 100)) + times[2]
+        times[2] = times[2].zfill(4)
+        # Imported diaries can go back as far as any date, but nothing can be logged after the current year
+        if int(times[2]) < 1 or int(times[2]) > datetime.now().year:
+            flash("Invalid value for year", category = "error")
+            return redirect("/memories")
+        searched_date = f"{times[2]}-{times[0]}-{times[1]}"
+        date_object = datetime.strptime(searched_date, "%Y-%m-%d")
+        searched_day = date_object.date()
+        # The window is "week", "month" or a number of days on each side of the searched day
+        span = request.values.get("span", "1")
+        start, end = date_window(searched_day, span)
+        versions = get_entry_versions(session["user_id"], start, end)
+        if not versions:
+            flash("No log entry available for that date. Try a different date.", category="error")
+            return redirect("/memories")
+
+        # A browser that already has this exact window gets a 304 before anything is loaded or rendered
+        etag = caching.results_etag(session["user_id"], start, end, versions, current_app.extensions["static_version"]())
+        if request.method == "GET" and etag in request.if_none_match:
+            response = Response(status=304)
+        else:
+            response = Response(render_results(session["user_id"], searched_day, versions))
+        response.set_etag(etag)
+        updated = [row.updated_at for row in versions if row.updated_at is not None]
+        if updated:
+            # updated_at is the server's local time, the header has to be in UTC
+            response.last_modified = max(updated).astimezone(timezone.utc)
+        # Cached by the browser only, and always checked with the ETag since the window can include today
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
+    else:
+        return redirect("/memories")
+
+
+def render_results(user_id, searched_day, versions):
+    # Each entry's modal is rendered once per revision and kept in the app's fragment cache (see caching.py), only entries whose
+    # modal isn't cached are loaded from the database
+    days = {}
+    for row in versions:
+        days[row.log_date] = (row.id, row.revision)
+    modals = {day: caching.get_fragment(user_id, day, entry_id, revision) for day, (entry_id, revision) in days.items()}
+    missing = [days[day][0] for day, modal in modals.items() if modal is None]
+    if missing:
+        entry_modal = get_template_attribute("memory_results.html", "entry_modal")
+        for entry in get_entries(missing):
+            modals[entry.log_date] = entry_modal(f"entrymodal{entry.id}", entry.log_date.strftime('%A %B %d, %Y'), entry.items, all_items)
+            caching.set_fragment(user_id, entry.log_date, entry.id, entry.revision, modals[entry.log_date])
+
+    readable_date = searched_day.strftime('%A %B %d, %Y')
+    day_modal = modals.get(searched_day)
+    others = [modal for day, modal in sorted(modals.items()) if day != searched_day]
+    return render_template("memory_results.html", date = readable_date, day_modal = day_modal, others = others)
@@ -0,0 +1,32 @@
+from markupsafe import Markup
+
+from cache import LRUCache
+
+# The inputs of the log form. Each item's block (name, description and its html from items.py) is rendered
+# once when the app starts, and the form for a set of preferred items is those blocks joined together,
+# cached per sorted tuple of categories. Rendering /log then only has to add the logged content.
+
+WIDGET = """<div id="pref-items">
+        <p><strong>Name:</strong> {{ item.name }}</p>
+        <p><strong>Description:</strong> {{ item.description }}</p>
+        <div class = "form-group">
+            {{ item.html|safe }}
+        </div>
+    </div>
+"""
+
+
+class LogForm:
+    def __init__(self, jinja_env, all_items):
+        template = jinja_env.from_string(WIDGET)
+        self.widgets = {category: Markup(template.render(item=item)) for category, item in all_items.items()}
+        # There are only as many keys as there are combinations of items
+        self.forms = LRUCache(maxsize=256)
+
+    def render(self, preferred_items):
+        key = tuple(sorted(preferred_items))
+        form = self.forms.get(key)
+        if form is None:
+            form = Markup("").join(self.widgets[category] for category in key if category in self.widgets)
+            self.forms.set(key, form)
+        return form